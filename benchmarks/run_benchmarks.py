@@ -0,0 +1,210 @@
+# Benchmarks for ebLink.
+#
+# Runs the full pipeline (build, model, calc_linkages, build_crosswalk) on the
+# bundled RLData sets and on synthetic data from synthetic.py, and reports
+# time per stage, throughput in record-iterations per second of sampling,
+# peak memory and linkage accuracy against the true identities. Results can
+# be appended to a JSON-lines file and compared against an earlier run of the
+# same benchmarks, to give before and after numbers for a change.
+#
+# Usage, from this directory:
+#    python run_benchmarks.py rl500 rl10000 synthetic-50000 --iterations 200
+#    python run_benchmarks.py rl500 --out after.jsonl --compare before.jsonl
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join(HERE, '..', 'test_data')
+sys.path.append(os.path.join(HERE, '..', 'python-encapsulation'))
+import eblink as eb
+import synthetic
+
+FIELDS = synthetic.FIELDS
+TYPES = {'fname_c1': 's', 'lname_c1': 's', 'by': 'c', 'bm': 'c', 'bd': 'c'}
+
+
+def _split(data, workdir, name, num_files=2, seed=0):
+    '''
+    Splits a DataFrame of records with UID and ID columns into num_files
+    csvs in workdir. Returns the filepaths and the entity of each UID.
+    '''
+    part = np.random.RandomState(seed).randint(0, num_files, len(data))
+    files = []
+    for i in range(num_files):
+        filename = os.path.join(workdir, '{}_{}.csv'.format(name, i + 1))
+        data[part == i][['UID'] + FIELDS].to_csv(filename, index=False)
+        files.append(filename)
+    return files, dict(zip(data.UID.astype(str), data.ID))
+
+def rl500(workdir):
+    files = [os.path.join(DATA, 'RLData500_{}.csv'.format(i)) for i in [1, 2, 3]]
+    identity = pd.read_csv(os.path.join(DATA, 'RLData500_identites.csv'))
+    return files, dict(zip(identity.UID.astype(str), identity.ID))
+
+def rl10000(workdir):
+    # The first column holds row names, which serve as UIDs
+    data = pd.read_csv(os.path.join(DATA, 'RLData10000.csv'), dtype=str,
+     keep_default_na=False)
+    data['UID'] = data.index
+    data['ID'] = pd.read_csv(os.path.join(DATA, 'RLData10000identity.csv')).x.values
+    return _split(data, workdir, 'rl10000')
+
+def synthetic_records(num_records):
+    def load(workdir):
+        source = synthetic.load_source(os.path.join(DATA, 'RLData10000.csv'))
+        data = synthetic.generate(num_records, source)
+        return _split(data, workdir, 'synthetic')
+    return load
+
+def dataset(name):
+    '''
+    Looks up a dataset by name: rl500, rl10000 or synthetic-<records>.
+    '''
+    if name == 'rl500':
+        return rl500
+    if name == 'rl10000':
+        return rl10000
+    if name.startswith('synthetic-'):
+        return synthetic_records(int(name.split('-')[1]))
+    raise NameError('Unknown dataset {}'.format(name))
+
+
+def pair_accuracy(clusters, truth):
+    '''
+    Precision, recall and F1 of the pairs of records placed in the same
+    cluster, against the pairs sharing a true entity.
+    '''
+    def pairs(sizes):
+        return (sizes * (sizes - 1) // 2).sum()
+    frame = pd.DataFrame({'cluster': clusters, 'truth': truth})
+    found = pairs(frame.groupby('cluster').size().values)
+    true = pairs(frame.groupby('truth').size().values)
+    correct = pairs(frame.groupby(['cluster', 'truth']).size().values)
+    precision = correct / float(found) if found else 1.
+    recall = correct / float(true) if true else 1.
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.
+    return precision, recall, f1
+
+def run(name, args):
+    '''
+    Runs the pipeline on one dataset. Returns a dict of results.
+    '''
+    workdir = tempfile.mkdtemp(prefix='eblink-bench-')
+    cwd = os.getcwd()
+    try:
+        files, identity = dataset(name)(workdir)
+        # EBlink keeps its temp files under the working directory
+        os.chdir(workdir)
+        link = eb.EBlink(files=[])
+        link.files = files
+        link.columns = [FIELDS] * len(files)
+        link.match_columns = dict((f, [f] * (len(files) - 1)) for f in FIELDS)
+        link.indices = ['UID'] * len(files)
+        link.column_types = TYPES
+        link.iterations = args.iterations
+        link.burn_in = args.burn_in
+        link.alpha = args.alpha
+        link.beta = args.beta
+        link.distance_cutoff = args.cutoff
+        link.set_profiling()
+        if args.block:
+            link.set_blocking(exact=args.block)
+        link.build()
+        link.model(backend=args.backend, workers=args.workers, chains=args.chains,
+         seeds=args.seed)
+        link.build_crosswalk()
+        link.clean_tmp()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    metrics = link.metrics
+    seconds = dict((stage, metrics[stage]['seconds']) for stage in
+     ['build', 'sampling', 'calc_linkages', 'build_crosswalk'] if stage in metrics)
+    truth = [identity[str(x)] for x in link.crosswalk.UID]
+    precision, recall, f1 = pair_accuracy(link.crosswalk.cluster.values, truth)
+    records = link._numrecords
+    return {'dataset': name, 'records': records, 'iterations': args.iterations,
+     'backend': args.backend, 'workers': args.workers, 'chains': args.chains,
+     'seconds': seconds, 'total_seconds': sum(seconds.values()),
+     'record_iterations_per_second': records * args.iterations * args.chains /
+      seconds['sampling'],
+     'peak_memory_mb': max(x['max_rss_mb'] for x in metrics.values()),
+     'pop_est': float(link.pop_est), 'true_pop': len(set(truth)),
+     'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+         cwd=HERE).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def report(results, compare=None):
+    '''
+    Prints a table of results, with the change in throughput against an
+    earlier run of the same dataset if compare is given.
+    '''
+    before = {}
+    if compare:
+        with open(compare, 'r') as f:
+            for line in f:
+                x = json.loads(line)
+                before[x['dataset']] = x
+    print '{:<18}{:>8}{:>10}{:>14}{:>10}{:>9}{:>9}{:>7}{:>7}{:>10}'.format('dataset',
+     'records', 'seconds', 'rec-iter/s', 'peak MB', 'pop_est', 'true', 'prec',
+     'recall', 'speedup')
+    for x in results:
+        speedup = ''
+        if x['dataset'] in before:
+            speedup = '{:.2f}x'.format(x['record_iterations_per_second'] /
+             before[x['dataset']]['record_iterations_per_second'])
+        print '{:<18}{:>8}{:>10.1f}{:>14.0f}{:>10.0f}{:>9.0f}{:>9}{:>7.3f}{:>7.3f}{:>10}'.format(
+         x['dataset'], x['records'], x['total_seconds'],
+         x['record_iterations_per_second'], x['peak_memory_mb'], x['pop_est'],
+         x['true_pop'], x['precision'], x['recall'], speedup)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks ebLink.')
+    parser.add_argument('datasets', nargs='*', default=['rl500', 'rl10000'],
+     help='rl500, rl10000 or synthetic-<records>')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--burn-in', type=int, default=0)
+    parser.add_argument('--alpha', type=float, default=10)
+    parser.add_argument('--beta', type=float, default=50)
+    parser.add_argument('--cutoff', type=int, default=None,
+     help='distance_cutoff for the numpy backend')
+    parser.add_argument('--backend', default='numpy')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chains', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None,
+     help='seed the numpy sampler, for repeatable runs')
+    parser.add_argument('--block', nargs='*', default=[],
+     help='columns to block on exactly')
+    parser.add_argument('--out', help='append results to this JSON-lines file')
+    parser.add_argument('--compare', help='JSON-lines results to compare against')
+    args = parser.parse_args()
+
+    results = []
+    for name in args.datasets:
+        result = run(name, args)
+        result['revision'] = _revision()
+        result['date'] = datetime.today().strftime('%Y-%m-%d %H:%M:%S')
+        results.append(result)
+        if args.out:
+            with open(args.out, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+    report(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Synthetic record linkage data for benchmarking ebLink.
+#
+# Follows the generative model in ebLink-master/R/code/model.R: latent
+# entities are drawn field by field from empirical distributions (here those
+# of RLData10000), records are linked to latents, and each field of each
+# record is distorted with probability beta. A distorted categorical field is
+# redrawn from its distribution, as in model.draw.X.c; a distorted string
+# field gets a one letter typo instead, so that it stays close to the latent
+# in edit distance.
+
+import numpy as np
+import pandas as pd
+
+FIELDS = ['fname_c1', 'lname_c1', 'by', 'bm', 'bd']
+STRING_FIELDS = ['fname_c1', 'lname_c1']
+LETTERS = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+
+def load_source(filename):
+    '''
+    Reads RLData10000 as the source of the field distributions.
+    '''
+    data = pd.read_csv(filename, dtype=str, keep_default_na=False)
+    return data[FIELDS]
+
+def _typos(values, rng):
+    '''
+    Replaces one letter of each string with a random letter.
+    '''
+    rv = []
+    for value, u, letter in zip(values, rng.random_sample(len(values)),
+     LETTERS[rng.randint(0, len(LETTERS), len(values))]):
+        if value:
+            i = int(u * len(value))
+            value = value[:i] + letter + value[i + 1:]
+        rv.append(value)
+    return rv
+
+def generate(num_records, source, duplicates=0.1, beta=0.01, seed=0):
+    '''
+    Draws num_records records of about num_records / (1 + duplicates)
+    entities, with each field distorted with probability beta. Returns a
+    DataFrame of the fields plus UID and the true entity ID.
+    '''
+    rng = np.random.RandomState(seed)
+    M = int(round(num_records / (1. + duplicates)))
+    # Every latent has at least one record; the rest are duplicates
+    lam = np.concatenate([np.arange(M), rng.randint(0, M, num_records - M)])
+    lam = lam[rng.permutation(num_records)]
+    data = pd.DataFrame({'UID': np.arange(1, num_records + 1), 'ID': lam + 1},
+     columns=['UID'] + FIELDS + ['ID'])
+    for col in FIELDS:
+        pool = source[col].values
+        Y = pool[rng.randint(0, len(pool), M)]
+        X = Y[lam].copy()
+        z = np.flatnonzero(rng.random_sample(num_records) < beta)
+        if col in STRING_FIELDS:
+            X[z] = _typos(X[z], rng)
+        else:
+            X[z] = pool[rng.randint(0, len(pool), len(z))]
+        data[col] = X
+    return data
@@ -16,13 +16,33 @@ from rpy2.robjects import pandas2ri
 import numpy as np
 
 STEEPNESS = 1
+HERE = os.path.dirname(os.path.abspath(__file__))
+_loaded = False # Whether load has run in this process
 
-def run_eblink(tmp, tmp_dir, column_types, a, b, iterations, filenum, numrecords):
+def load():
     '''
-    Provides an interface with R to run ebLink in the background through R.
+    Readies R in this process: activates pandas conversion and sources the
+    ebLink scripts and packages. Only the first call does any work, so a
+    long-lived worker pays for it once rather than on every job.
     '''
+    global _loaded
+    if _loaded:
+        return
     pandas2ri.activate()
-    # Get base packages
+    ro.r("d <- function(string1,string2){adist(string1,string2)}")
+    ro.r("len_uniq <- function(x){length(unique(x))}")
+    for name in ['ebGibbsSampler.R', 'analyzeGibbs.R']:
+        ro.r("source('{}', chdir = TRUE)".format(find(name, os.path.join(HERE, '..'))))
+    importr("plyr")
+    _loaded = True
+
+def run_eblink(tmp, tmp_dir, column_types, a, b, iterations, filenum, numrecords,
+ burn_in=0, thin=1):
+    '''
+    Provides an interface with R to run ebLink in the background through R.
+    Drops the first burn_in iterations and keeps every thin-th one after.
+    '''
+    load()
     # Import data to link
     data = ro.r('read.csv(file = "{}", header = T)'.format(tmp))
     # Set necessary variables
@@ -48,26 +68,24 @@ def run_eblink(tmp, tmp_dir, column_types, a, b, iterations, filenum, numrecords
     b = ro.IntVector([b])
     # Steepness parameter; pre-set to recommended value
     c = ro.IntVector([STEEPNESS])
-    # Edit distance function; can be swapped for others if desired
-    ro.r("d <- function(string1,string2){adist(string1,string2)}")
+    # Edit distance function, defined by load; can be swapped for others if desired
     d = ro.r['d']
-    # Loads in Gibbs sampler and plyr packages
-    eb_pack = ro.r("source('{}', chdir = TRUE)".format(find('ebGibbsSampler.R', '../../')))
-    plyr = importr("plyr")
     # Move to tmp directory to save results file
+    cwd = os.getcwd()
     os.chdir(tmp_dir)
     print 'Running the gibbs sampler...'
     # Runs the gibbs sampler
-    gibbs = ro.r['rl.gibbs']
-    lam = gibbs(file_num = fn, X_s = xs, X_c=xc, num_gs=g, a=a, b=b, c=c, d=d, M=m)
-    os.chdir('..')
+    try:
+        gibbs = ro.r['rl.gibbs']
+        lam = gibbs(file_num = fn, X_s = xs, X_c=xc, num_gs=g, a=a, b=b, c=c, d=d, M=m)
+    finally:
+        os.chdir(cwd)
     # Calculate estimated population sizes by finding number of uniques
     appl = ro.r['apply']
-    ro.r("len_uniq <- function(x){length(unique(x))}")
     len_uniq = ro.r['len_uniq']
     estPopSize = appl(lam, 1, len_uniq)
 
-    return np.array(lam), np.array(estPopSize)
+    return np.array(lam)[burn_in::thin], np.array(estPopSize)[burn_in::thin]
 
 def calc_linkages(linkage):
     '''
@@ -77,11 +95,10 @@ def calc_linkages(linkage):
     Returns pairs of entries that have been matched using their entry number
     in the tmp file.
     '''
-    pandas2ri.activate()
-    link_pack = ro.r("source('{}', chdir = TRUE)".format(find('analyzeGibbs.R', '.')))
+    load()
     links = ro.r['links']
     matrix = ro.r['as.matrix']
-    linkage = matrix(linkage)
+    linkage = matrix(np.asarray(linkage))
     est_links = links(linkage)
     pairwise = ro.r['pairwise']
     pairs = pairwise(est_links)
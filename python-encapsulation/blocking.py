@@ -0,0 +1,104 @@
+# Blocking for ebLink.
+#
+# Records are only compared with records sharing their blocking key, so a
+# large linkage job can be split into many small, independent ones. Keys are
+# built from exact values, phonetic codes (Soundex) and string prefixes of the
+# linking columns.
+
+import numpy as np
+
+SOUNDEX_CODES = dict([(c, str(d)) for d, letters in enumerate(
+ ['AEIOUY', 'BFPV', 'CGJKQSXZ', 'DT', 'L', 'MN', 'R']) for c in letters])
+
+def soundex(value, length=4):
+    '''
+    Returns the American Soundex code of a string, e.g. ROBERT -> R163.
+    '''
+    letters = [c for c in str(value).upper() if c.isalpha()]
+    if not letters:
+        return ''
+    rv = letters[0]
+    last = SOUNDEX_CODES.get(letters[0])
+    for c in letters[1:]:
+        code = SOUNDEX_CODES.get(c)
+        if code is None: # H and W do not separate letters with the same code
+            continue
+        if code != '0' and code != last:
+            rv += code
+        last = code
+    return (rv + '000')[:length]
+
+def prefix(value, length):
+    '''
+    Returns the first length characters of a string.
+    '''
+    return str(value)[:length]
+
+
+class Blocking(object):
+
+    def __init__(self, exact=[], phonetic=[], prefix={}):
+        '''
+        exact is a list of columns that must match exactly, phonetic a list of
+        string columns that must share a Soundex code and prefix a dict of
+        {column: number of leading characters that must match}. Column names
+        are those of the first file.
+        '''
+        self.exact = list(exact)
+        self.phonetic = list(phonetic)
+        self.prefix = dict(prefix)
+        if not (self.exact or self.phonetic or self.prefix):
+            raise ValueError('Blocking needs at least one key.')
+
+    @property
+    def columns(self):
+        return self.exact + self.phonetic + sorted(self.prefix)
+
+    def key(self, record):
+        '''
+        Blocking key for a record given as a dict of {column: value}.
+        '''
+        rv = [str(record[col]) for col in self.exact]
+        rv += [soundex(record[col]) for col in self.phonetic]
+        rv += [prefix(record[col], self.prefix[col]) for col in sorted(self.prefix)]
+        return tuple(rv)
+
+    def keys(self, columns):
+        '''
+        Blocking keys for a chunk of records given as a dict of {column:
+        sequence of values}. Each distinct value is only coded once.
+        '''
+        parts = [_map_values(columns[col], str) for col in self.exact]
+        parts += [_map_values(columns[col], soundex) for col in self.phonetic]
+        parts += [_map_values(columns[col], lambda x, n=self.prefix[col]: prefix(x, n))
+         for col in sorted(self.prefix)]
+        return zip(*parts)
+
+def _map_values(values, function):
+    '''
+    Applies function to each distinct value, mapping the results back.
+    '''
+    uniques, inverse = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+    return np.array([function(x) for x in uniques], dtype=object)[inverse]
+
+def assign_blocks(keys, ids=None):
+    '''
+    Numbers the distinct blocking keys. Returns an array with the block of
+    each record. ids maps keys already numbered to their blocks and is
+    updated with any new keys.
+    '''
+    if ids is None:
+        ids = {}
+    rv = np.empty(len(keys), dtype=np.int64)
+    for i, key in enumerate(keys):
+        rv[i] = ids.setdefault(key, len(ids))
+    return rv
+
+def block_members(blocks):
+    '''
+    Splits record positions by block. Returns a list of index arrays, one per
+    block, in block order.
+    '''
+    order = np.argsort(blocks, kind='mergesort')
+    bounds = np.cumsum(np.bincount(blocks))[:-1]
+    return np.split(order, bounds)
@@ -0,0 +1,53 @@
+# Crosswalk construction for ebLink.
+#
+# Linked pairs are merged into clusters with an array-based union-find over
+# ETL_IDs, which follows links transitively, and the crosswalk is laid out as
+# columns (cluster, file, UID, ETL_ID) with one row per record.
+
+import numpy as np
+import pandas as pd
+
+def find_clusters(numrecords, pairs):
+    '''
+    Union-find over records 0..numrecords-1 joined by pairs of ETL_IDs
+    (numbered from 1). Roots are hooked onto the smaller of two roots and
+    paths are compressed by pointer jumping, all on whole arrays. Returns the
+    cluster of each record, numbered in order of each cluster's first record.
+    '''
+    parent = np.arange(numrecords)
+    if len(pairs):
+        pairs = np.asarray(pairs, dtype=np.int64) - 1
+        a, b = pairs[:, 0], pairs[:, 1]
+        while True:
+            ra, rb = parent[a], parent[b]
+            if (ra == rb).all():
+                break
+            low = np.minimum(ra, rb)
+            np.minimum.at(parent, ra, low)
+            np.minimum.at(parent, rb, low)
+            # Point every record straight at its root
+            while True:
+                grand = parent[parent]
+                if (grand == parent).all():
+                    break
+                parent = grand
+    return np.unique(parent, return_inverse=True)[1]
+
+def representatives(clusters, score):
+    '''
+    Picks one record from each cluster: the one with the highest score, the
+    earliest on ties. Returns the positions of the picked records in order.
+    '''
+    order = np.lexsort((np.arange(len(clusters)), -np.asarray(score), clusters))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = clusters[order[1:]] != clusters[order[:-1]]
+    return np.sort(order[first])
+
+def crosswalk_frame(clusters, filenum, uids):
+    '''
+    Lays out the crosswalk with one row per record: its cluster, its file
+    number, its UID in that file and its ETL_ID.
+    '''
+    return pd.DataFrame({'cluster': clusters, 'file': np.asarray(filenum),
+     'UID': uids, 'ETL_ID': np.arange(1, len(clusters) + 1)},
+     columns=['cluster', 'file', 'UID', 'ETL_ID'])
@@ -0,0 +1,114 @@
+# Convergence diagnostics for ebLink's Gibbs sampler.
+#
+# The diagnostics are computed on the trace of the estimated population size
+# (the number of distinct latents linked to at each kept iteration): its
+# effective sample size, Geweke's z-score comparing the start and end of a
+# chain, and the split R-hat of Gelman et al. (2013) across chains.
+
+import numpy as np
+
+def autocorrelation(x):
+    '''
+    Autocorrelation of a trace at every lag, computed with an FFT.
+    '''
+    x = np.asarray(x, dtype=float)
+    x = x - x.mean()
+    n = len(x)
+    f = np.fft.rfft(x, 2 * n)
+    acov = np.fft.irfft(f * np.conjugate(f))[:n]
+    if acov[0] == 0:
+        return np.zeros(n)
+    return acov / acov[0]
+
+def ess(x):
+    '''
+    Effective sample size of a trace, summing autocorrelations over Geyer's
+    initial positive sequence. A constant trace counts in full.
+    '''
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    if n < 4 or x.var() == 0:
+        return float(n)
+    rho = autocorrelation(x)
+    pairs = rho[:n - n % 2].reshape(-1, 2).sum(axis=1)
+    stop = np.flatnonzero(pairs <= 0)
+    pairs = pairs[:stop[0]] if len(stop) else pairs
+    tau = -1 + 2 * pairs.sum()
+    return n / max(tau, 1. / np.log10(n))
+
+def geweke(x, first=0.1, last=0.5):
+    '''
+    Geweke's z-score comparing the mean of the first and last parts of a
+    trace, with variances corrected for autocorrelation.
+    '''
+    x = np.asarray(x, dtype=float)
+    a, b = x[:int(first * len(x))], x[len(x) - int(last * len(x)):]
+    if len(a) < 2 or len(b) < 2:
+        return 0.
+    var = a.var() / ess(a) + b.var() / ess(b)
+    if var == 0:
+        return 0. if a.mean() == b.mean() else np.inf
+    return (a.mean() - b.mean()) / np.sqrt(var)
+
+def split_rhat(traces):
+    '''
+    Split R-hat over one or more chains: each chain is cut in half and the
+    between- and within-half variances compared. Values near 1 indicate the
+    chains have mixed.
+    '''
+    n = min(len(x) for x in traces) // 2
+    if n < 2:
+        return np.inf
+    halves = np.array([h for x in traces for h in (x[:n], x[len(x) - n:])], dtype=float)
+    W = halves.var(axis=1, ddof=1).mean()
+    B = n * halves.mean(axis=1).var(ddof=1)
+    if W == 0:
+        return 1. if B == 0 else np.inf
+    return np.sqrt(((n - 1.) / n * W + B / n) / W)
+
+
+class StoppingRule(object):
+    '''
+    Thresholds for stopping a Gibbs run once it has converged: the
+    population size trace needs an effective sample size of at least
+    min_ess, Geweke z-scores within max_geweke and a split R-hat of at most
+    max_rhat. Checked every check_every iterations once min_draws draws are
+    kept.
+    '''
+
+    def __init__(self, min_ess=200, max_geweke=2.0, max_rhat=1.05,
+     check_every=500, min_draws=100):
+        self.min_ess = min_ess
+        self.max_geweke = max_geweke
+        self.max_rhat = max_rhat
+        self.check_every = check_every
+        self.min_draws = min_draws
+
+    def diagnose(self, traces):
+        '''
+        Diagnostics for the population size traces of one or more chains:
+        the number of draws, the total effective sample size, the largest
+        absolute Geweke z-score and the split R-hat.
+        '''
+        return {'draws': sum(len(x) for x in traces),
+         'ess': sum(ess(x) for x in traces),
+         'geweke': max(abs(geweke(x)) for x in traces),
+         'rhat': split_rhat(traces)}
+
+    def converged(self, traces):
+        '''
+        Whether the traces meet every threshold. Returns a boolean and the
+        reason.
+        '''
+        if min(len(x) for x in traces) < self.min_draws:
+            return False, 'fewer than {} draws'.format(self.min_draws)
+        d = self.diagnose(traces)
+        checks = [('ESS {:.0f}'.format(d['ess']), d['ess'] >= self.min_ess,
+         ('>=', '<'), self.min_ess),
+         ('|Geweke z| {:.2f}'.format(d['geweke']), d['geweke'] <= self.max_geweke,
+         ('<=', '>'), self.max_geweke),
+         ('split R-hat {:.3f}'.format(d['rhat']), d['rhat'] <= self.max_rhat,
+         ('<=', '>'), self.max_rhat)]
+        reason = ', '.join('{} {} {}'.format(label, ops[0] if ok else ops[1], limit)
+         for label, ok, ops, limit in checks)
+        return all(x[1] for x in checks), reason
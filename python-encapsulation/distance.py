@@ -0,0 +1,219 @@
+# String distance kernels for ebLink.
+#
+# The sampler weighs a distorted string by exp(-c * d(x, y)), where d is the
+# edit distance. rl.gibbs computes this for every pair of distinct values with
+# adist; here only pairs within an edit distance cutoff are kept, in a sparse
+# matrix, and pairs further apart get zero weight. Kernels can be cached on
+# disk, keyed by the field's distinct values, so that repeated runs over the
+# same files skip recomputation.
+
+import hashlib
+import os
+import tempfile
+import numpy as np
+import scipy.sparse
+
+BATCH_CELLS = 2 ** 22 # Max string pair x character cells compared at once
+
+
+def _char_codes(values):
+    '''
+    Pads strings into a matrix of character codes. Returns the matrix and the
+    length of each string.
+    '''
+    values = [unicode(v) if not isinstance(v, basestring) else v for v in values]
+    width = max([len(v) for v in values] + [1])
+    chars = np.full((len(values), width), -1, dtype=np.int32)
+    for i, v in enumerate(values):
+        chars[i, :len(v)] = [ord(x) for x in v]
+    return chars, np.array([len(v) for v in values], dtype=np.int64)
+
+def _levenshtein(a, len_a, b, len_b):
+    '''
+    Edit distance between the rows of a and b, where each row is a padded
+    array of character codes. Runs the usual dynamic program over character
+    positions for all pairs at once.
+    '''
+    pairs, width = a.shape
+    prev = np.tile(np.arange(width + 1), (pairs, 1))
+    out = np.where(len_a == 0, len_b, 0)
+    rows = np.arange(pairs)
+    for i in range(1, width + 1):
+        cur = np.empty_like(prev)
+        cur[:, 0] = i
+        for j in range(1, width + 1):
+            sub = prev[:, j - 1] + (a[:, i - 1] != b[:, j - 1])
+            cur[:, j] = np.minimum(np.minimum(prev[:, j], cur[:, j - 1]) + 1, sub)
+        done = len_a == i
+        out[done] = cur[rows[done], len_b[done]]
+        prev = cur
+    return out
+
+def pair_distances(values, first, second):
+    '''
+    Edit distances between values[first[i]] and values[second[i]] for each i,
+    computed in batches.
+    '''
+    chars, lengths = _char_codes(values)
+    rv = np.empty(len(first), dtype=np.int64)
+    step = max(1, BATCH_CELLS // (chars.shape[1] + 1))
+    for start in range(0, len(first), step):
+        a = first[start:start + step]
+        b = second[start:start + step]
+        rv[start:start + step] = _levenshtein(chars[a], lengths[a], chars[b], lengths[b])
+    return rv
+
+def edit_distances(values):
+    '''
+    Computes the matrix of Levenshtein distances between every pair of strings
+    in values. Equivalent to adist(S, S) in R, vectorized over pairs.
+    '''
+    n = len(values)
+    first = np.repeat(np.arange(n), n)
+    second = np.tile(np.arange(n), n)
+    return pair_distances(values, first, second).reshape(n, n)
+
+def _deletions(value, cutoff):
+    '''
+    All strings reachable from value by deleting up to cutoff characters.
+    '''
+    rv = set([value])
+    frontier = rv
+    for _ in range(cutoff):
+        frontier = set(v[:i] + v[i + 1:] for v in frontier for i in range(len(v)))
+        rv |= frontier
+    return rv
+
+def close_pairs(values, cutoff):
+    '''
+    Finds every pair of values within edit distance cutoff of each other.
+    Two strings within distance k always share a string reachable from both
+    by at most k deletions, so only pairs sharing a deletion variant are
+    compared. Returns arrays (first, second, distance) with first < second.
+    '''
+    variants = {}
+    for i, v in enumerate(values):
+        for d in _deletions(v, cutoff):
+            variants.setdefault(d, []).append(i)
+    first = []
+    second = []
+    for members in variants.itervalues():
+        if len(members) > 1:
+            members = np.array(members)
+            a, b = np.triu_indices(len(members), 1)
+            first.append(members[a])
+            second.append(members[b])
+    if not first:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    n = len(values)
+    pairs = np.unique(np.concatenate(first) * n + np.concatenate(second))
+    first, second = pairs // n, pairs % n
+    distance = pair_distances(values, first, second)
+    keep = distance <= cutoff
+    return first[keep], second[keep], distance[keep]
+
+
+class DistanceKernel(object):
+    '''
+    The matrix exp(-c * d(v, w)) over the distinct values v, w of a string
+    field, stored as a CSR matrix. With a cutoff, pairs further apart than the
+    cutoff are left out and weigh zero; without one every pair is kept, as in
+    rl.gibbs.
+    '''
+
+    def __init__(self, matrix):
+        self.matrix = scipy.sparse.csr_matrix(matrix)
+        self.matrix.sort_indices()
+        self.size = self.matrix.shape[0]
+        # Flat (row, column) keys of the stored entries, in sorted order
+        rows = np.repeat(np.arange(self.size), np.diff(self.matrix.indptr))
+        self._keys = rows * self.size + self.matrix.indices
+
+    @classmethod
+    def build(cls, values, c=1, cutoff=None, cache_dir=None):
+        '''
+        Computes the kernel for a list of distinct values, or loads it from
+        cache_dir if it has been computed before for the same values, c and
+        cutoff.
+        '''
+        path = None
+        if cache_dir:
+            key = hashlib.sha1(repr((c, cutoff, list(values)))).hexdigest()
+            path = os.path.join(cache_dir, 'kernel-{}.npz'.format(key))
+            if os.path.isfile(path):
+                return cls(scipy.sparse.load_npz(path))
+
+        n = len(values)
+        if cutoff is None:
+            matrix = np.exp(-c * edit_distances(values).astype(float))
+        else:
+            first, second, distance = close_pairs(values, cutoff)
+            weight = np.exp(-c * distance.astype(float))
+            rows = np.concatenate([first, second, np.arange(n)])
+            cols = np.concatenate([second, first, np.arange(n)])
+            data = np.concatenate([weight, weight, np.ones(n)])
+            matrix = scipy.sparse.csr_matrix((data, (rows, cols)), shape=(n, n))
+        rv = cls(matrix)
+
+        if path:
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # Another process may have made it first
+                if not os.path.isdir(cache_dir):
+                    raise
+            # Write under a name of our own and rename, so processes sharing
+            # the cache never load a partly written kernel
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    scipy.sparse.save_npz(f, rv.matrix)
+                os.rename(tmp, path)
+            except Exception:
+                os.remove(tmp)
+                raise
+        return rv
+
+    def normalizers(self, alpha):
+        '''
+        h(w) = 1 / sum_v alpha(v) exp(-c * d(w, v)) for every value w.
+        '''
+        return 1.0 / self.matrix.dot(alpha)
+
+    def lookup(self, x, y):
+        '''
+        Kernel entries for each pair (x[i], y[i]); zero where not stored.
+        '''
+        keys = np.asarray(x) * self.size + np.asarray(y)
+        pos = np.minimum(np.searchsorted(self._keys, keys), max(len(self._keys) - 1, 0))
+        found = self._keys[pos] == keys
+        return np.where(found, self.matrix.data[pos], 0.0)
+
+    def row_products(self, x, groups, num_groups, power=None):
+        '''
+        For records with values x split into sorted groups, computes the
+        product of the kernel rows of each group's records, each raised to
+        the record's power, if given. Only values in the support of a group's
+        first row can be non-zero, so just those are scored. Returns (group,
+        value, weight) triples sorted by group.
+        '''
+        starts = np.searchsorted(groups, np.arange(num_groups))
+        sizes = np.diff(np.append(starts, len(groups)))
+        # Candidate values for each group
+        indptr = self.matrix.indptr
+        first = x[starts]
+        lengths = indptr[first + 1] - indptr[first]
+        cand_group = np.repeat(np.arange(num_groups), lengths)
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        cand_value = self.matrix.indices[np.repeat(indptr[first], lengths) + within]
+        # Score each candidate against every record in its group
+        per_cand = sizes[cand_group]
+        offsets = np.cumsum(per_cand) - per_cand
+        recs = np.repeat(starts[cand_group], per_cand) + \
+         np.arange(per_cand.sum()) - np.repeat(offsets, per_cand)
+        scores = self.lookup(x[recs], np.repeat(cand_value, per_cand))
+        if power is not None:
+            scores **= power[recs]
+        weight = np.multiply.reduceat(scores, offsets) if len(offsets) else scores
+        return cand_group, cand_value, weight
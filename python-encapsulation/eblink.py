@@ -2,26 +2,33 @@
 # 7/27/2016
 
 # This file is an encapsulation in Python for ebLink, which runs in R.
-# This program requires R to run.
+# This program requires R to run, unless the numpy backend is selected in model.
 # ebLink is drawn from Steorts, et. al. 2015 can can be found here:
 #    https://github.com/resteorts/ebLink
 
 ## NOTES ##
-# Current build only takes csvs. To add additional file types or connections,
-#    please look at read_iterator.
+# Build streams csvs (plain, .gz or .bz2), Parquet files and pandas DataFrames
+#    through readers.py. To add additional file types or connections, please
+#    look at read_iterator.
 
 from datetime import datetime
-import rpy2
+import numpy as np
 import pandas as pd
 import os
-import random
 import subprocess
+import tempfile
 import csv
-# Execute necessary dependencies for rpy2
-from numpy import *
-import scipy as sp
-from pandas import *
 import pickle
+import numbers
+from blocking import Blocking, assign_blocks, block_members
+from parallel import run_units, merge_chains
+from crosswalk import find_clusters, crosswalk_frame, representatives
+from records import RecordStore, collapse
+from readers import read_chunks, CHUNK_ROWS
+from diagnostics import StoppingRule
+from profiling import Profiler, stage
+from run_store import LazyStates, RunStore, save_run
+from rng import Streams
 
 class EBlink(object):
 
@@ -29,7 +36,7 @@ class EBlink(object):
         ## File locations & directories
         self._files = files # A list of filepaths or, possibly, python objects
         self._tmp_dir = None # Directory where temp files are stored
-        self._tmp = None # Temporary csv for use in link
+        self._records = None # Columnar store of the linking fields for all files
         self._crosswalk_file = None # File where crosswalk is saved
         self._interactive = interactive # Whether this will be run interactively
         ## Inputs
@@ -37,18 +44,42 @@ class EBlink(object):
         self._indices = {} # Specifies UID columns for each file
         self._matchcolumns = {} # Contains lists mapping columns in other files to self._columns
         self._column_types = {} # Maps first file's columns to String or Categorical
+        self._blocking = None # Blocking keys used to split the linkage, if any
+        self.chunk_rows = CHUNK_ROWS # Rows read from a file at a time
+        self._stopping = None # Convergence thresholds for stopping runs early, if any
+        self._profiler = None # Records timings of each stage, if profiling
+        self._priors = None # Shared prior tables of each field, if any (numpy backend)
+        self._workers = None # Addresses and authkey of long-lived workers, if used
         ## Subjective inputs
         self.alpha = None # Alpha value for prior
         self.beta = None # Beta value for prior
         self.iterations = 0 # Number of gibbs iterations to run
+        self.burn_in = 0 # Number of initial gibbs iterations to discard
+        self.thin = 1 # Keep every thin-th gibbs iteration after burn-in
+        self.distance_cutoff = None # Max edit distance given weight (numpy backend)
+        self.distance_cache = None # Directory for caching string distances (numpy backend)
+        # Gibbs iterations between checkpoints, 0 for none (numpy backend)
+        self.checkpoint_every = 0
+        # Sample identical records of a file as one row (numpy backend)
+        self.collapse_duplicates = False
         ## Constructed inputs
         self._numrecords = 0 # Number of records
         self._filenum = [] # Labels each entry in joined CSV with file number from self._files
+        self._blocks = None # Labels each entry in joined CSV with its block
+        self._block_ids = {} # Maps each blocking key to its block
+        self._uids = [] # UID of each entry in joined CSV, from its own file
         ## Outputs from ebLink
         self.pop_est = 0 # De-duplicated/linked population estimated by ebLink
         self.pairs = None # Pairs linked by ebLink
+        self.chain_pop_est = None # Population estimated by each chain
+        self.between_chain_var = None # Variance of the chains' estimates
         self.crosswalk = None # Crosswalk of UIDs
-        self._lookup_pairs = {} # Create a dict to look-up pairs of entries
+        self._clusters = None # Cluster of each entry in joined CSV, from pairs
+        self.convergence = {} # Convergence diagnostics of each block's population size trace
+        self._results = {} # Estimated population and linked pairs of each block
+        self._states = {} # Final sampler state of each block (numpy backend)
+        self._lambda_files = {} # Lambda draws of each block's chains
+        self._num_linked = 0 # Number of records covered by the last model run
         ## Interactive mode
         if self._interactive == True:
             self._run_interactively()
@@ -74,7 +105,8 @@ class EBlink(object):
 
     @files.setter
     def files(self, files):
-        if type(files) == list and len(filter(lambda x: os.path.isfile(x), files)) == len(files):
+        if type(files) == list and len(filter(lambda x: isinstance(x, pd.DataFrame)
+         or os.path.isfile(x), files)) == len(files):
             self._files = files
         else:
             raise TypeError('Filename(s) input poorly formatted.')
@@ -303,58 +335,212 @@ class EBlink(object):
             self.beta = b
             self.iterations = iterations
 
-    def build(self, headers=False):
+    def set_blocking(self, exact=[], phonetic=[], prefix={}):
+        '''
+        Splits the linkage into independent blocks: only records that agree
+        on every blocking key can be linked. exact lists columns that must
+        match exactly, phonetic lists string columns that must share a
+        Soundex code and prefix maps columns to a number of leading characters
+        that must match. Uses column names from the first file. Must be set
+        before build.
+        '''
+        blocking = Blocking(exact, phonetic, prefix)
+        for col in blocking.columns:
+            if col not in self._columns[0]:
+                raise NameError('Blocking column {} not in columns'.format(col))
+        self._blocking = blocking
+
+    def set_stopping(self, min_ess=200, max_geweke=2.0, max_rhat=1.05,
+     check_every=500, min_draws=100):
+        '''
+        Lets numpy runs stop before self.iterations once they have converged.
+        Every check_every iterations, each chain checks its population size
+        trace, once it has min_draws kept draws, for an effective sample size
+        of at least min_ess, a Geweke z-score within max_geweke and a split
+        R-hat of at most max_rhat, and stops when all three are met.
+        '''
+        self._stopping = StoppingRule(min_ess, max_geweke, max_rhat,
+         check_every, min_draws)
+
+    def set_profiling(self, log=None, callback=None):
+        '''
+        Records the wall time, peak memory and counts of each stage of a run:
+        build, the string distance computations, every step of every Gibbs
+        iteration (numpy backend), sampling as a whole, calc_linkages and
+        build_crosswalk. Totals by stage are kept in metrics. If log is a
+        filepath, every record is also appended to it as a line of JSON, and
+        callback is called with every record. Records from worker processes
+        are passed on as each model run finishes.
+        '''
+        self._profiler = Profiler(log, callback)
+
+    def set_priors(self, priors):
+        '''
+        Has numpy runs take each field's empirical distribution and string
+        normalizers from shared prior tables rather than recomputing them
+        from the records of every block. priors is a dict of field to
+        priors.PriorTable or a directory of saved tables.
+        '''
+        if isinstance(priors, basestring):
+            from priors import load_priors
+            priors = load_priors(priors)
+        self._priors = priors
+
+    def build_priors(self, directory=None):
+        '''
+        Builds prior tables from the records read by build and uses them for
+        every block of later runs. If directory is given, the tables are also
+        saved there to be reused by other runs with set_priors.
+        '''
+        # Imported here, as the distance code loads scipy
+        from gibbs_sampler import STEEPNESS
+        from priors import build_priors, save_priors
+        with stage(self._profiler, 'build_priors'):
+            self._priors = build_priors(self._records, self.column_types,
+             STEEPNESS, self.distance_cutoff, self.distance_cache)
+        if directory:
+            save_priors(self._priors, directory)
+
+    def set_workers(self, addresses, authkey):
+        '''
+        Runs the samplers of later model runs on long-lived workers started
+        with worker.py, which keep their backend loaded between jobs, rather
+        than in fresh processes. addresses is a list of (host, port) pairs.
+        Pass None to go back to local processes.
+        '''
+        self._workers = (addresses, authkey) if addresses else None
+
+    def _aligned_priors(self, fields):
+        '''
+        alpha and h of every value in the record store from the prior
+        tables, one (alpha, h) per sampler field.
+        '''
+        from gibbs_sampler import STEEPNESS
+        rv = []
+        for f in fields:
+            table = self._priors[f]
+            if table.c != STEEPNESS or table.cutoff != self.distance_cutoff:
+                raise ValueError('Prior table for {} was built with c={} and cutoff={}.'.format(
+                 f, table.c, table.cutoff))
+            rv.append(table.align(self._records.values[f]))
+        return rv
+
+    @property
+    def metrics(self):
+        return self._profiler.metrics if self._profiler else {}
+
+    def build(self, headers=False, filename=None):
         '''
         Builds the inputs for ebLink. Constructs filenum input as well as
-        a single hidden tmp csv for feeding into the system.
+        a columnar store of the linking fields, integer coded, for feeding
+        into the system. If filename is given, the store is also saved there
+        as a .npz file.
+
+        If blocking is set, also labels each record with its block.
         '''
         if len(self._files) < 2:
             print 'Only one file found. Please set additional files.'
             return
 
-        self._build_directory()
-        columns = self._columns[0] + ['ETL_ID'] # Adding a temporary ID
+        with stage(self._profiler, 'build', files=len(self._files)) as record:
+            self._build_directory()
+            self._records = RecordStore(self._columns[0])
+            keys = [] # Blocking key of each record
 
-        with open(self._tmp, 'w') as dest:
-            wtr = csv.writer(dest)
             file_count = 1
             # Go through each file
             for f in self._files:
-                rdr, fi = self.read_iterator(f)
-                headers = rdr.next()
-                # In case iterator returns tuples instead of lists
-                if type(headers) == tuple:
-                    headers = list(headers)
-                if file_count == 1:
-                    wtr.writerow(columns)
-                # For each line in that file
-                for line in rdr:
-                    # In case iterator returns tuples instead of lists
-                    if type(line) == tuple:
-                        line = list(line)
-                    # Count records
-                    self._numrecords += 1
-                    # Add file number to column to be fed into ebLink
-                    self._filenum.append(file_count)
-                    if file_count == 1:
-                        row = []
-                        for col in self._columns[0]:
-                            index = headers.index(col)
-                            row.append(line[index])
-                    elif file_count >= 2:
-                    # Else use match_columns to make sure columns are matched to
-                    # first file's columns in the new file.
-                        row = []
-                        for col in self._columns[0]:
-                            index = headers.index(self._matchcolumns[col][file_count-2])
-                            row.append(line[index])
-                    # Add additional ID, unique for the link
-                    row.append(self._numrecords)
-                    wtr.writerow(row)
-                if fi:
-                    fi.close()
+                self._read_file(f, file_count, keys)
                 file_count += 1
 
+            self._records.finish()
+            self._filenum = self._records.filenum
+            self._uids = self._records.uids
+            if filename:
+                self._records.save(filename)
+
+            if self._blocking:
+                self._block_ids = {}
+                self._blocks = assign_blocks(keys, self._block_ids)
+                print 'Records split into {} blocks.'.format(self._blocks.max() + 1)
+            record.update(self._record_counts())
+
+    def _read_file(self, f, file_count, keys):
+        '''
+        Reads the linking fields of one file into the record store, adding
+        the blocking key of each record to keys. Files are streamed in chunks
+        of chunk_rows rows, reading only the linking and UID columns.
+        '''
+        # Find the columns to use in this file, matched to the first
+        # file's columns using match_columns
+        if file_count == 1:
+            cols = list(self._columns[0])
+        else:
+            cols = [self._matchcolumns[col][file_count-2] for col in self._columns[0]]
+        # Get the UID column within this file, if it has one
+        unique = self._indices[file_count - 1]
+        wanted = cols + [unique] if unique and unique not in cols else cols
+        for chunk in read_chunks(f, wanted, self.chunk_rows, self.read_iterator):
+            columns = [chunk[col].values for col in cols]
+            if self._blocking:
+                keys.extend(self._blocking.keys(dict(zip(self._columns[0], columns))))
+            # Keep the UID for the crosswalk, else fall back on ETL_ID
+            if unique:
+                uids = list(chunk[unique].values)
+            else:
+                uids = range(self._numrecords + 1, self._numrecords + len(chunk) + 1)
+            self._records.append_columns(columns, file_count, uids)
+            # Count records
+            self._numrecords += len(chunk)
+
+    def add_files(self, files, match_columns={}, indices=[]):
+        '''
+        Adds new files to a linkage that has already been built and modeled,
+        such as one loaded with EBlink.load. match_columns maps each of the
+        first file's columns to a list of the matching columns in the new
+        files, and indices lists the UID column of each new file (False if it
+        has none). Only the new files are read; model_incremental then links
+        their records against the existing population.
+        '''
+        with stage(self._profiler, 'add_files', files=len(files)) as record:
+            keys = []
+            file_count = len(self._files) + 1
+            for i, f in enumerate(files):
+                self._files.append(f)
+                for col in self._columns[0]:
+                    self._matchcolumns.setdefault(col, []).append(match_columns[col][i])
+                unique = indices[i] if i < len(indices) else False
+                if type(self._indices) == list:
+                    self._indices.append(unique)
+                else:
+                    self._indices[file_count - 1] = unique
+                self._read_file(f, file_count, keys)
+                file_count += 1
+
+            self._records.finish()
+            self._filenum = self._records.filenum
+            self._uids = self._records.uids
+            if self._blocking:
+                self._blocks = np.concatenate([self._blocks,
+                 assign_blocks(keys, self._block_ids)])
+            print '{} records added.'.format(self._numrecords - self._num_linked)
+            record.update(self._record_counts())
+
+    def _record_counts(self):
+        '''
+        Counts of records and of distinct values per field, for profiling.
+        '''
+        return {'records': self._numrecords, 'distinct_values':
+         dict((f, len(self._records.values[f])) for f in self._records.fields)}
+
+    @staticmethod
+    def load(filename):
+        '''
+        Loads an EBlink saved with pickle.
+        '''
+        with open(filename, 'r') as f:
+            return pickle.load(f)
+
     def read_iterator(self, filepath):
         '''
         Takes a filepath and returns an iterator. Iterator returns each line as
@@ -366,6 +552,9 @@ class EBlink(object):
         return tuples or lists, where each column is a separate tuple or list
         entry.
 
+        Csv and Parquet files and DataFrames are streamed by readers.py in
+        build; this is used for any other source.
+
         **ADD NEW CONNECTIONS/FILE TYPES HERE**
         '''
         ### CSV ###
@@ -385,140 +574,338 @@ class EBlink(object):
     def _build_directory(self):
         '''
         Private function to build a temporary directory for storing data.
+        Its name is unique, so concurrent runs never share one.
         '''
-        self._tmp_dir = '._tmp-{}'.format(random.randint(0, 10000))
-        bashCommand = 'mkdir {}'.format(self._tmp_dir)
-        output = subprocess.check_output(['bash','-c', bashCommand])
-        now = datetime.today().strftime('%y%m%d-%H%M%S')
-        self._tmp = '{}/{}-{:.2}.csv'.format(self._tmp_dir, now, random.random())
+        self._tmp_dir = os.path.abspath(tempfile.mkdtemp(prefix='._tmp-', dir='.'))
 
-    def model(self):
+    def model(self, backend='R', workers=1, chains=1, resume=False, seeds=None,
+     scatter=False):
         '''
         Carries out modeling in R. Returns a numpy array
-        '''
-        import R_interface as ri
-        result, estPopSize = ri.run_eblink(self._tmp, self._tmp_dir,
-         self.column_types, self.alpha, self.beta, self.iterations, self._filenum,
-         self._numrecords)
-        self.pop_est = np.average(estPopSize)
-        del estPopSize
+
+        Set backend to 'numpy' to run the Gibbs sampler in numpy instead,
+        which does not require R. If blocking is set, each block is modeled
+        separately and the results are joined back together by ETL_ID.
+
+        chains runs several independent chains on each block and pools their
+        samples. Blocks and chains are run over a pool of worker processes
+        if workers is more than 1.
+
+        With the numpy backend, lambda draws are streamed to .npy files in the
+        tmp directory (lambda-<block>-<chain>.npy) and read back as memory
+        maps, and the state each block ends in is kept for model_incremental.
+
+        The numpy backend also checkpoints each chain's full state to
+        checkpoint-<block>-<chain>.npz in the tmp directory every
+        checkpoint_every iterations and when it finishes. resume continues an
+        interrupted run from those checkpoints: pass True to use this
+        object's tmp directory or the path of the tmp directory of the
+        interrupted run, after calling build with the same inputs.
+
+        seeds seeds the numpy sampler: a list with one seed per chain or a
+        single seed, from which chain i uses seed + i. Each step of each
+        iteration of each block's chain then draws from its own random
+        stream (see rng.py), so seeded runs repeat exactly however they are
+        spread over workers. By default every chain starts from the data, as
+        in rl.gibbs; with scatter set, each starts from its own random state
+        instead, which takes a longer burn_in but makes disagreement between
+        chains a stronger check of convergence. Afterwards chain_pop_est
+        holds the population estimate of each chain and between_chain_var
+        the variance between them.
+        '''
+        if backend not in ('numpy', 'R'):
+            raise NameError('Backend {} is not supported.'.format(backend))
+        if backend == 'R' and (resume or self.checkpoint_every):
+            raise ValueError('Checkpoints are only supported by the numpy backend.')
+        if backend == 'R' and self._stopping:
+            raise ValueError('Early stopping is only supported by the numpy backend.')
+        if backend == 'R' and self._priors:
+            raise ValueError('Prior tables are only supported by the numpy backend.')
+        if backend == 'R' and (seeds is not None or scatter):
+            raise ValueError('Seeds and scattered starts are only supported by the numpy backend.')
+        if isinstance(seeds, numbers.Integral):
+            seeds = [seeds + i for i in range(chains)]
+        if seeds is not None and len(seeds) != chains:
+            raise ValueError('Expected {} seeds, one per chain.'.format(chains))
+        if resume and resume is not True:
+            if not os.path.isdir(resume):
+                raise IOError('{} is not a directory.'.format(resume))
+            # Drop the fresh tmp directory from build in favour of the old one
+            if self._tmp_dir and os.path.isdir(self._tmp_dir) and not os.listdir(self._tmp_dir):
+                os.rmdir(self._tmp_dir)
+            self._tmp_dir = os.path.abspath(resume)
+
+        self._results = {}
+        self._states = {}
+        self._lambda_files = {}
+        self.convergence = {}
+        self._sample_blocks(backend, dict(enumerate(self._block_rows())),
+         workers, chains, self.iterations, resume=bool(resume), seeds=seeds,
+         scatter=scatter)
+        self._num_linked = self._numrecords
+        self._collect_results()
+
+    def model_incremental(self, iterations=None, refresh=0, workers=1):
+        '''
+        Links records added with add_files against the population estimated
+        by the last numpy model run. Only blocks holding new records are
+        sampled again: each starts from the state the last run ended in,
+        with every new record linked to a latent of its own, and only the
+        new records' z and lambda are drawn, except during the last refresh
+        iterations, when the existing records are redrawn too. Blocks with no
+        saved state are sampled from scratch.
+
+        iterations defaults to self.iterations. Afterwards, rebuild the
+        crosswalk with build_crosswalk.
+        '''
+        if not self._states:
+            raise ValueError('Incremental linkage needs a model run with the numpy backend.')
+        if not os.path.isdir(self._tmp_dir):
+            self._build_directory()
+        blocks = {}
+        for b, rows in enumerate(self._block_rows()):
+            if len(rows) and rows[-1] >= self._num_linked:
+                blocks[b] = rows
+        self._sample_blocks('numpy', blocks, workers, 1,
+         iterations or self.iterations, refresh, incremental=True)
+        self._num_linked = self._numrecords
+        self._collect_results()
+
+    def _block_rows(self):
+        '''
+        Record positions of each block, or of all records if unblocked.
+        '''
+        if self._blocks is None:
+            return [np.arange(self._numrecords)]
+        return block_members(self._blocks)
+
+    def _sample_blocks(self, backend, blocks, workers, chains, iterations,
+     refresh=0, incremental=False, resume=False, seeds=None, scatter=False):
+        '''
+        Runs the sampler on blocks, a dict of block number to record
+        positions, and stores the estimated population and linked pairs of
+        each block in self._results. The numpy backend also saves the final
+        state of each block's first chain in self._states, with latent values
+        as record store codes. If incremental is set, blocks with a saved
+        state start from it and only draw records added since. If resume is
+        set, chains continue from their checkpoints. seeds and scatter are
+        as in model.
+        '''
+        if backend == 'numpy':
+            import numpy_interface as ri
+        else:
+            import R_interface as ri
+        filenum = np.asarray(self._filenum)
+        fields = self._records.sampler_fields(self.column_types)
+        priors = self._aligned_priors(fields) if self._priors else None
+
+        # Set up one unit of work per chain for every block to be sampled
+        units = []
+        sampled = []
+        profiles = [] # Profiling logs of the units, with their block and chain
+        for b in sorted(blocks):
+            rows = blocks[b]
+            if len(rows) == 1:
+                self._results[b] = (1, [])
+                self._lambda_files.pop(b, None)
+                self._states.pop(b, None)
+                continue
+            if backend == 'numpy':
+                # Hand over the integer codes directly
+                records = self._records.matrix(self.column_types, rows)
+            else:
+                # R reads the records from a csv
+                records = '{}/block-{}.csv'.format(self._tmp_dir, b)
+                self._records.to_frame(rows).to_csv(records, index=False)
+            # Renumber files from 1 as some files may be absent in a block
+            files = list(np.unique(filenum[rows], return_inverse=True)[1] + 1)
+            collapsed = {}
+            if backend == 'numpy' and self.collapse_duplicates and not incremental:
+                X, files, weights, expand = collapse(records[0], files)
+                if len(X) < len(rows):
+                    records = (X, records[1], records[2])
+                    collapsed = {'weights': weights, 'expand': expand}
+            block_priors = None
+            if backend == 'numpy' and priors:
+                # Slice the shared priors down to the values in the block
+                used = [np.unique(self._records.codes[col][rows]) for col in fields]
+                block_priors = [(alpha[u], None if h is None else h[u])
+                 for (alpha, h), u in zip(priors, used)]
+            args = (records, self._tmp_dir, self.column_types, self.alpha,
+             self.beta, iterations, files, len(rows))
+            for chain in range(chains):
+                kwargs = {'burn_in': self.burn_in, 'thin': self.thin}
+                kwargs.update(collapsed)
+                if backend == 'numpy':
+                    kwargs.update({'cutoff': self.distance_cutoff,
+                     'cache_dir': self.distance_cache and os.path.abspath(self.distance_cache),
+                     'out': '{}/lambda-{}-{}.npy'.format(self._tmp_dir, b, chain)})
+                    if chain == 0:
+                        kwargs['state_file'] = '{}/state-{}.npz'.format(self._tmp_dir, b)
+                    if self.checkpoint_every or resume:
+                        kwargs.update({'resume': resume,
+                         'checkpoint_every': self.checkpoint_every,
+                         'checkpoint': '{}/checkpoint-{}-{}.npz'.format(self._tmp_dir, b, chain)})
+                    if self._stopping:
+                        kwargs['stopping'] = self._stopping
+                    if seeds is not None:
+                        kwargs['streams'] = Streams(seeds[chain], chain, b)
+                    if scatter:
+                        kwargs['scatter'] = True
+                    if block_priors:
+                        kwargs['priors'] = block_priors
+                    if self._profiler:
+                        kwargs['profile'] = '{}/profile-{}-{}.jsonl'.format(
+                         self._tmp_dir, b, chain)
+                        if os.path.exists(kwargs['profile']):
+                            os.remove(kwargs['profile'])
+                        profiles.append((kwargs['profile'], b, chain))
+                    if incremental and b in self._states:
+                        state = dict(self._states[b])
+                        # Latent values were saved as store codes; recode
+                        # them for the records now in the block
+                        state['Y'] = state['Y'].copy()
+                        for l, col in enumerate(fields):
+                            used = np.unique(self._records.codes[col][rows])
+                            state['Y'][:, l] = np.searchsorted(used, state['Y'][:, l])
+                        kwargs.update({'init': state, 'refresh': refresh,
+                         'active': rows >= self._num_linked})
+                units.append((backend, args, kwargs))
+            sampled.append((b, rows))
+
+        with stage(self._profiler, 'sampling', units=len(units),
+         records=sum([len(x[1]) for x in sampled])):
+            results = run_units(units, workers, *(self._workers or ()))
+        for log, b, chain in profiles:
+            self._profiler.read_log(log, block=b, chain=chain)
+        for i, (b, rows) in enumerate(sampled):
+            self._diagnose(b, [x[1] for x in results[i * chains:(i + 1) * chains]],
+             [x[2] for x in results[i * chains:(i + 1) * chains]], iterations)
+            result, estPopSize = merge_chains(results[i * chains:(i + 1) * chains])
+            self._lambda_files[b] = [x[0] for x in results[i * chains:(i + 1) * chains]]
+            pop_est = np.average(estPopSize)
+            pairs = []
+            if pop_est <= len(rows) - 1:
+                # Only look for linked pairs if there are pairs to look for
+                with stage(self._profiler, 'calc_linkages', records=len(rows),
+                 draws=len(result)) as record:
+                    p = ri.calc_linkages(result)
+                    record['pairs'] = len(p)
+                # Map positions within the block back to ETL_IDs
+                pairs = [tuple(rows[np.array(x, dtype=int) - 1] + 1) for x in p]
+            self._results[b] = (pop_est, pairs)
+            del result, estPopSize
+            if backend == 'numpy':
+                state = dict(np.load('{}/state-{}.npz'.format(self._tmp_dir, b)))
+                for l, col in enumerate(fields):
+                    used = np.unique(self._records.codes[col][rows])
+                    state['Y'][:, l] = used[state['Y'][:, l]]
+                self._states[b] = state
+        for unit in units:
+            if unit[0] == 'R' and os.path.exists(unit[1][0]):
+                os.remove(unit[1][0])
+
+    def _diagnose(self, b, traces, runs, iterations):
+        '''
+        Records convergence diagnostics for the population size traces of
+        block b's chains in self.convergence: those of
+        StoppingRule.diagnose, whether they meet the stopping thresholds and
+        why, and runs, the number of iterations each chain ran out of
+        iterations.
+        '''
+        rule = self._stopping or StoppingRule()
+        rv = rule.diagnose(traces)
+        rv['converged'], rv['reason'] = rule.converged(traces)
+        rv['chain_pop_est'] = [float(np.mean(x)) for x in traces]
+        rv['iterations'] = [int(x) for x in runs]
+        rv['stopped_early'] = min(rv['iterations']) < iterations
+        self.convergence[b] = rv
+        if rv['stopped_early']:
+            print 'Block {} stopped early, running {} iterations per chain: {}'.format(
+             b, rv['iterations'], rv['reason'])
+
+    def _collect_results(self):
+        '''
+        Totals the population estimates and gathers the pairs of all blocks.
+        '''
+        self.pop_est = 0
+        self.pairs = []
+        for b in sorted(self._results):
+            pop_est, pairs = self._results[b]
+            self.pop_est += pop_est
+            self.pairs += pairs
+        # Per chain totals need the same number of chains in every block;
+        # blocks of one record weren't sampled and count once in each
+        self.chain_pop_est = None
+        self.between_chain_var = None
+        chains = set(len(self.convergence[b]['chain_pop_est'])
+         for b in self._results if b in self.convergence)
+        if len(chains) == 1:
+            totals = np.zeros(chains.pop())
+            for b in self._results:
+                totals += self.convergence[b]['chain_pop_est'] \
+                 if b in self.convergence else self._results[b][0]
+            self.chain_pop_est = list(totals)
         print "Estimated population size: ", self.pop_est
+        if self.chain_pop_est and len(self.chain_pop_est) > 1:
+            self.between_chain_var = float(np.var(self.chain_pop_est, ddof=1))
+            print "Estimate of each chain: ", self.chain_pop_est
+            print "Between chain variance: ", self.between_chain_var
         print "Total number of records: ", self._numrecords
-        if self.pop_est <= self._numrecords - 1:
-            # Only look for linked pairs if there are pairs to look for
-            p = ri.calc_linkages(result)
-            self.pairs = [tuple(x) for x in p]
-        del result
 
     def build_crosswalk(self):
         '''
-        Writes identified links to a file using UIDs.
-
-        ## This function uses Pandas and may need to be edited for scaling! ##
+        Builds a crosswalk of UIDs from the identified links. Linked records
+        are merged into clusters, following links transitively, and the
+        crosswalk has one row per record with columns cluster, file (file
+        number), UID and ETL_ID.
         '''
-        if not self.pairs: # Don't run this if there aren't any pairs
+        if not self.pairs:
             print 'No pairs identified.'
-            return
-
-        for pair in self.pairs:
-            self._lookup_pairs = self._add_to_dict(self._lookup_pairs, pair[0], pair[1])
-        rv = {} # This is the output data set
-        new_id = 0 # This is a new, uninteresting id for building rv
-        filenum_index = 0 # This is for indexing into the self.filenum object
-        placed = {} # Memo
-
-        # Go through each file and read through all the objects
-        for i in range(len(self._files)):
-            fp = self._files[i]
-            rdr, fi = self.read_iterator(fp)
-            headers = list(rdr.next()) # Get headers for this file
-            unique = self._indices[i] # Grab UID name this file from build
-            uni_index = headers.index(unique) # Get the index for the UID within this file
-
-            for line in rdr:
-                line = list(line)
-                # Check that file and filenum specified align
-                if self._filenum[filenum_index] != (i + 1):
-                    print "WARNING: File numbers don't match for entry {}.".format(filenum_index)
-                    print 'Listed file {} should be {}.'.format(self._filenum[filenum_index], i + 1)
-                    print 'Aborting. Check inputs for mismatch.'
-                    print 'Index with error: ', filenum_index
-                    print self._filenum[filenum_index + 1], ' is next.'
-                    print 'Filenum: ', self._filenum
-                    return
-
-                # Check if this entry has matches that are already placed
-                placed_matches = []
-                if filenum_index in self._lookup_pairs:
-                    placed_matches = [x for x in self._lookup_pairs[filenum_index] if x in placed]
-
-                if len(placed_matches) > 0:
-                    # If so, then add this UID to that entry
-                    match_index = placed[placed_matches[0]]
-                    # If there's already an entry in this column, it means that
-                    # ebLink has detected a duplicate within the data file.
-                    # This will be recorded as a tuple, but can be ignored
-                    # later.
-                    if rv[match_index][i] != '':
-                        old = rv[match_index][i]
-                        rv[match_index][i] = (old, line[uni_index])
-                    # Otherwise just add the new UID
-                    else:
-                        rv[match_index][i] = line[uni_index]
-                    placed[filenum_index] = match_index
-                    filenum_index += 1
-                else:
-                    # Else add the unique id from original file for a new id
-                    rv[new_id] = ['' for y in range(len(self._files))]
-                    rv[new_id][i] = line[uni_index]
-                    placed[filenum_index] = new_id
-                    new_id += 1
-                    filenum_index += 1
-            if fi:
-                fi.close()
-
-        # Place crosswalk into attributes as a Pandas Dataframe
-        self.crosswalk = pd.DataFrame.from_dict(rv, orient='index')
-
-    def build_linked_data(self, interactive=False):
-        '''
-        Builds a set of linked data.
-        '''
-        rv = []
-        data = pd.read_csv(self._tmp)
-        keeps = [x[0] for x in self.pairs] # Entries to keep
-        deletes = [y for sub in [x[1:] for x in self.pairs] for y in sub] # Flattens list of others
-
-        rv.append(self._columns[0] + ['ETL_ID'])
-        for i in range(len(self._filenum)):
-            if interactive and (i+1 in keeps or i+1 in deletes):
+        with stage(self._profiler, 'build_crosswalk', records=self._numrecords,
+         pairs=len(self.pairs or [])) as record:
+            self._clusters = find_clusters(self._numrecords, self.pairs or [])
+            self.crosswalk = crosswalk_frame(self._clusters, self._filenum, self._uids)
+            record['clusters'] = int(self._clusters.max()) + 1 if len(self._clusters) else 0
+
+    def build_linked_data(self, interactive=False, rule='first_file'):
+        '''
+        Builds a set of linked data, keeping one record from each cluster of
+        linked records. rule picks the record kept: 'first_file' keeps the
+        one from the earliest file, 'most_recent' the one from the latest file
+        and 'most_complete' the one with the most non-empty linking fields,
+        ties going to the lowest ETL_ID. If interactive, the user picks the
+        record to keep from each cluster instead.
+        '''
+        if self._clusters is None or len(self._clusters) != self._numrecords:
+            self._clusters = find_clusters(self._numrecords, self.pairs or [])
+        data = self._records.to_frame()
+        filenum = np.asarray(self._filenum)
+        if rule == 'first_file':
+            score = -filenum
+        elif rule == 'most_recent':
+            score = filenum
+        elif rule == 'most_complete':
+            score = self._records.filled()
+        else:
+            raise NameError('Rule {} is not supported.'.format(rule))
+        keep = representatives(self._clusters, score)
+
+        if interactive:
+            sizes = np.bincount(self._clusters)
+            for i, k in enumerate(keep):
+                if sizes[self._clusters[k]] == 1:
+                    continue
+                linked = list(np.flatnonzero(self._clusters == self._clusters[k]) + 1)
                 print 'Linked entries:'
-                print '  Entry {}: {}'.format(i+1, list(data.iloc[i]))
-                for j in self._lookup_pairs[i]:
-                    print '  Entry {}: {}'.format(j, list(data.iloc[j]))
-                keep = None
-                while keep not in self._lookup_pairs[i]:
-                    keep = int(raw_input('Please select which ETL_ID to keep: '))
-                keep = int(keep.strip())- 1
-                rv.append(list(data.iloc[keep]))
-            elif i+1 not in deletes:
-                rv.append(list(data.iloc[i]))
-
-        self.linked_set = pd.DataFrame(rv)
-
-    def _add_to_dict(self, dict, value1, value2):
-        '''
-        Adds both values and redundantly refers them to one another in dict.
-        '''
-        if value1 not in dict:
-            dict[value1] = [value2]
-        elif value1 in dict:
-            dict[value1].append(value2)
-        if value2 not in dict:
-            dict[value2] = [value1]
-        elif value2 in dict:
-            dict[value2].append(value1)
-        return dict
+                for j in linked:
+                    print '  Entry {}: {}'.format(j, list(data.iloc[j - 1]))
+                choice = None
+                while choice not in linked:
+                    choice = int(raw_input('Please select which ETL_ID to keep: '))
+                keep[i] = choice - 1
+
+        self.linked_set = data.take(np.sort(keep)).reset_index(drop=True)
 
     def pickle(self, filename=None):
         '''
@@ -531,6 +918,67 @@ class EBlink(object):
         f.close()
         return True
 
+    def save_run(self, path):
+        '''
+        Saves the settings, records, lambda draws and outputs of the last run
+        to the directory path, as JSON and .npy files. Unlike pickle, the run
+        can be reopened without reading all of it; see open_run.
+        '''
+        save_run(self, path)
+        print 'Run saved to {}.'.format(path)
+
+    @staticmethod
+    def open_run(path):
+        '''
+        Opens a run saved with save_run as an EBlink, with its records, pairs
+        and crosswalk memory-mapped rather than read. The lambda draws stay
+        on disk (see RunStore.lambda_history) and each block's sampler state
+        is read when first used. The run gets a new tmp directory, ready for
+        add_files and model_incremental.
+        '''
+        run = RunStore(path)
+        config = run.config
+        link = EBlink(files=config['files'])
+        link._columns = config['columns']
+        link._matchcolumns = config['match_columns']
+        link._indices = config['indices']
+        if isinstance(link._indices, dict):
+            # JSON keys are strings; files are numbered from 0
+            link._indices = dict((int(k), v) for k, v in link._indices.items())
+        link._column_types = config['column_types']
+        for key in ['alpha', 'beta', 'iterations', 'burn_in', 'thin',
+         'distance_cutoff', 'pop_est', 'chain_pop_est', 'between_chain_var']:
+            setattr(link, key, config[key])
+        # Settings added to the format later keep their defaults if missing
+        for key in ['distance_cache', 'chunk_rows', 'checkpoint_every',
+         'collapse_duplicates']:
+            if key in config:
+                setattr(link, key, config[key])
+        if config['blocking']:
+            link._blocking = Blocking(**config['blocking'])
+        link._block_ids = dict((tuple(k), v) for k, v in config['block_ids'])
+        link._blocks = run.blocks
+        link._records = run.records
+        link._filenum = link._records.filenum
+        link._uids = link._records.uids
+        link._numrecords = config['numrecords']
+        link._num_linked = config['num_linked']
+        link.convergence = dict((int(b), x) for b, x in config['convergence'].items())
+        link.pairs = [tuple(x) for x in run.pairs]
+        link.crosswalk = run.crosswalk
+        if link.crosswalk is not None:
+            link._clusters = link.crosswalk.cluster.values
+        # Each pair lies within one block, that of its first record
+        pair_blocks = np.zeros(len(link.pairs), dtype=int) if link._blocks is None \
+         else link._blocks[run.pairs[:, 0] - 1]
+        link._results = dict((b, (pop_est, [p for p, pb in zip(link.pairs,
+         pair_blocks) if pb == b])) for b, pop_est, _ in config['results'])
+        link._states = LazyStates(run)
+        link._lambda_files = dict((int(b), [os.path.join(path, 'lambda', x)
+         for x in files]) for b, files in config['lambda'].items())
+        link._build_directory()
+        return link
+
     def write(self, obj, filename):
         '''
         Writes ebLink object to file.
@@ -0,0 +1,464 @@
+# Gibbs sampler for ebLink written with numpy.
+#
+# This is a port of rl.gibbs in ebLink-master/R/code/ebGibbsSampler.R, drawn
+# from Steorts (2015), "Entity Resolution with Empirically Motivated Priors",
+# Bayesian Analysis, 10(4): 849-975. Please credit her work when using it.
+#
+# Records are passed in as a matrix of integer codes, one column per field,
+# with the string fields first followed by the categorical fields (the same
+# order as cbind(X.s, X.c) in the R code). Every update is carried out on whole
+# arrays rather than per cell.
+
+import os
+import numpy as np
+from distance import DistanceKernel
+from lambda_store import LambdaWriter
+from latent_index import InvertedIndex, LatentMembers
+from profiling import stage
+
+STEEPNESS = 1
+
+
+def sample_categorical(weights, rng, size=None):
+    '''
+    Draws indices with probability proportional to weights. If weights is a
+    matrix, draws one index per row.
+    '''
+    weights = np.asarray(weights, dtype=float)
+    if weights.ndim == 1:
+        cum = np.cumsum(weights)
+        u = rng.random_sample(size) * cum[-1]
+        return np.minimum(np.searchsorted(cum, u, side='right'), len(cum) - 1)
+    cum = np.cumsum(weights, axis=1)
+    u = rng.random_sample(len(cum)) * cum[:, -1]
+    rv = (cum <= u[:, None]).sum(axis=1)
+    return np.minimum(rv, weights.shape[1] - 1)
+
+def sample_segments(weights, segments, num_segments, rng):
+    '''
+    Draws one entry per segment with probability proportional to weights.
+    segments labels each entry and must be sorted. Returns the position of
+    the chosen entry for each segment, or -1 for segments with no entries.
+    '''
+    starts = np.searchsorted(segments, np.arange(num_segments))
+    stops = np.searchsorted(segments, np.arange(num_segments), side='right')
+    nonempty = stops > starts
+    rv = np.full(num_segments, -1, dtype=np.int64)
+    if not nonempty.any():
+        return rv
+    # Scale each segment by its largest weight to keep the cumulative sum sane
+    top = np.ones(num_segments)
+    top[nonempty] = np.maximum.reduceat(weights, starts[nonempty])
+    top[top == 0] = 1
+    cum = np.cumsum(weights / top[segments])
+    starts, stops = starts[nonempty], stops[nonempty]
+    base = np.where(starts > 0, cum[starts - 1], 0)
+    u = base + rng.random_sample(len(starts)) * (cum[stops - 1] - base)
+    pick = np.searchsorted(cum, u, side='right')
+    rv[nonempty] = np.minimum(np.maximum(pick, starts), stops - 1)
+    return rv
+
+
+class GibbsSampler(object):
+
+    def __init__(self, X, filenum, num_string, a, b, values=None, c=STEEPNESS,
+     M=None, seed=None, cutoff=None, cache_dir=None, profiler=None, priors=None,
+     streams=None, weights=None, expand=None):
+        '''
+        X is an N x p matrix of integer codes (string fields first), filenum
+        the file number of each record (starting at 1), num_string the number
+        of string fields, a and b the Beta prior parameters and values a list
+        holding the distinct strings behind the codes of each string field.
+        M is the number of latent entities (defaults to N).
+
+        cutoff is the largest edit distance at which two strings are still
+        given weight; by default every pair is. String distance kernels are
+        cached in cache_dir, if given.
+
+        profiler is a profiling.Profiler to record the time taken by the
+        distance computations and each step of every iteration.
+
+        priors is a list holding (alpha, h) for each field, indexed by code,
+        to use in place of the empirical distributions of X (see priors.py);
+        h is None for categorical fields.
+
+        streams is an rng.Streams. If given, every step of every iteration
+        draws from its own stream, keyed by the step and iteration, instead
+        of from one generator seeded with seed.
+
+        weights is the number of identical records each row of X stands for,
+        all of which share the row's z and lambda, and expand the row of each
+        of those records; the lambda history covers the records rather than
+        the rows.
+        '''
+        self.profiler = profiler
+        self.X = np.asarray(X, dtype=np.int64)
+        self.N, self.p = self.X.shape
+        self.ps = num_string
+        self._file = np.asarray(filenum, dtype=np.int64) - 1
+        self.k = self._file.max() + 1
+        self.w = np.ones(self.N) if weights is None else np.asarray(weights, dtype=float)
+        self.weighted = weights is not None and (self.w != 1).any()
+        self.expand = expand
+        self.n = np.bincount(self._file, weights=self.w, minlength=self.k)
+        self.a = float(a)
+        self.b = float(b)
+        self.c = c
+        self.M = M or self.N
+        self.rng = np.random.RandomState(seed)
+        self.streams = streams
+        if self.ps and values is None:
+            raise ValueError('String values are needed to compute distances.')
+
+        ## Empirical distributions, distances and normalizing factors
+        if priors is None:
+            # Weighted by the records each row stands for, so collapsing
+            # duplicates leaves the priors as they are
+            self.alpha = [np.bincount(self.X[:, l], weights=self.w) / self.w.sum()
+             for l in range(self.p)]
+        else:
+            self.alpha = [np.asarray(x[0], dtype=float) for x in priors]
+        with stage(profiler, 'distances', records=self.N,
+         distinct_values=[len(x) for x in self.alpha]) as record:
+            self.ecd = [DistanceKernel.build(values[l], c, cutoff, cache_dir)
+             for l in range(self.ps)]
+            if priors is None:
+                self.h = [self.ecd[l].normalizers(self.alpha[l]) for l in range(self.ps)]
+            else:
+                self.h = [np.asarray(priors[l][1], dtype=float) for l in range(self.ps)]
+            record['stored_distances'] = sum(x.matrix.nnz for x in self.ecd)
+        # alpha(X) * h(X) for each record; the string match probability only
+        # ever needs h and ecd at Y == X, where ecd is 1
+        self._ah = np.empty((self.N, self.p))
+        for l in range(self.p):
+            self._ah[:, l] = self.alpha[l][self.X[:, l]]
+            if l < self.ps:
+                self._ah[:, l] *= self.h[l][self.X[:, l]]
+        # Weight of an empty latent for a record, before multiplying by the
+        # number of empty latents: alpha(X) on undistorted fields, times
+        # sum_y alpha(y) h(y) ecd(X, y) on distorted string fields
+        self._pool = [self._pool_weights(l) for l in range(self.ps)]
+
+        ## Initial values
+        self.beta = np.full((self.k, self.p), self.a / (self.a + self.b))
+        self.z = np.zeros((self.N, self.p), dtype=np.int8)
+        # Lock the latents to the data, recycling records if M > N
+        self.Y = self.X[np.arange(self.M) % self.N].copy()
+        self.lam = np.arange(self.N) % self.M
+        self.members = LatentMembers(self.lam, self.M)
+        self._build_index()
+        self.active = None # Mask of records whose z and lambda are drawn; None for all
+
+    def get_state(self):
+        '''
+        The current draws of beta, z, Y and lambda.
+        '''
+        return {'beta': self.beta.copy(), 'z': self.z.copy(), 'Y': self.Y.copy(),
+         'lam': self.lam.copy()}
+
+    def set_state(self, state):
+        '''
+        Starts the chain from a state returned by get_state. The state may
+        cover only the first records, files and latents, as when new records
+        are linked against an existing population: the records beyond it start
+        out undistorted, each linked to an unused latent copied from it.
+        '''
+        n, m = len(state['lam']), len(state['Y'])
+        new = np.arange(n, self.N)
+        if m + len(new) > self.M:
+            raise ValueError('Not enough latents for the new records.')
+        self.beta[:len(state['beta'])] = state['beta']
+        self.z[:n] = state['z']
+        self.z[n:] = 0
+        self.Y[:m] = state['Y']
+        self.Y[m:m + len(new)] = self.X[new]
+        self.lam[:n] = state['lam']
+        self.lam[new] = m + np.arange(len(new))
+        self.members = LatentMembers(self.lam, self.M)
+        self._build_index()
+
+    def _pool_weights(self, l):
+        '''
+        sum_y alpha(y) (h(y) ecd(X, y)) ** w for string field l of each row.
+        '''
+        matrix = self.ecd[l].matrix
+        rv = matrix.dot(self.alpha[l] * self.h[l])[self.X[:, l]]
+        heavy = np.flatnonzero(self.w != 1)
+        if len(heavy):
+            x = self.X[heavy, l]
+            lengths = np.diff(matrix.indptr)[x]
+            starts = np.cumsum(lengths) - lengths
+            entries = np.repeat(matrix.indptr[x], lengths) + \
+             np.arange(lengths.sum()) - np.repeat(starts, lengths)
+            y = matrix.indices[entries]
+            terms = self.alpha[l][y] * (self.h[l][y] * matrix.data[entries]) ** \
+             np.repeat(self.w[heavy], lengths)
+            rv[heavy] = np.bincount(np.repeat(np.arange(len(heavy)), lengths),
+             weights=terms, minlength=len(heavy))
+        return rv
+
+    def _indexed_Y(self):
+        # Empty latents are indexed under an extra value no record holds, so
+        # they are never candidates; draw_lambda scores them as one pool
+        occupied = self.members.counts > 0
+        return np.where(occupied[:, None], self.Y, [len(x) for x in self.alpha])
+
+    def _build_index(self):
+        self.index = InvertedIndex(self._indexed_Y(), [len(x) + 1 for x in self.alpha])
+
+    def scatter(self):
+        '''
+        Starts the chain from a random state rather than from the data, so
+        that several chains start apart: each record is linked to a random
+        latent, each latent takes the values of one of its records (or of a
+        random record if it has none) and the fields where a record differs
+        from its latent count as distorted.
+        '''
+        self._stream('scatter')
+        lam = self.rng.randint(0, self.M, self.N)
+        Y = self.X[self.rng.randint(0, self.N, self.M)]
+        order = self.rng.permutation(self.N)
+        Y[lam[order]] = self.X[order]
+        self.set_state({'beta': self.beta, 'Y': Y, 'lam': lam,
+         'z': (self.X != Y[lam]).astype(np.int8)})
+
+    def save_checkpoint(self, filename, g, est_pop, kept):
+        '''
+        Saves the state after g iterations to a .npz file, along with the RNG
+        state, the population size estimates so far and the number of draws
+        kept. The file is written under a temporary name and then renamed, so
+        an interrupted write leaves the previous checkpoint intact.
+        '''
+        name, keys, pos, has_gauss, gauss = self.rng.get_state()
+        arrays = self.get_state()
+        arrays.update({'iteration': g, 'est_pop': np.array(est_pop, dtype=np.int64),
+         'kept': kept, 'rng_keys': keys, 'rng_pos': pos,
+         'rng_gauss': np.array([has_gauss, gauss])})
+        if self.active is not None:
+            arrays['active'] = self.active
+        # The order of the posting lists decides the order latents are
+        # offered to sample_segments, so keep it for an exact restart
+        for l in range(self.p):
+            arrays['order_{}'.format(l)] = self.index.order[l]
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp, filename)
+
+    def load_checkpoint(self, filename):
+        '''
+        Restores a checkpoint saved with save_checkpoint. Returns the number
+        of iterations done, the population size estimates so far and the
+        number of draws kept.
+        '''
+        data = np.load(filename)
+        self.set_state(data)
+        self.active = data['active'] if 'active' in data.files else None
+        for l in range(self.p):
+            self.index.order[l] = data['order_{}'.format(l)]
+        has_gauss, gauss = data['rng_gauss']
+        self.rng.set_state(('MT19937', data['rng_keys'], int(data['rng_pos']),
+         int(has_gauss), float(gauss)))
+        return int(data['iteration']), list(data['est_pop']), int(data['kept'])
+
+    def draw_beta(self):
+        z_sums = np.zeros((self.k, self.p))
+        np.add.at(z_sums, self._file, self.z * self.w[:, None])
+        self.beta = self.rng.beta(z_sums + self.a, self.n[:, None] - z_sums + self.b)
+
+    def draw_z(self):
+        '''
+        z is 1 wherever X differs from its latent; elsewhere it is a binomial
+        draw from the relative weight of the distorted outcome.
+        '''
+        rec = self._active_records()
+        match = self.X[rec] == self.Y[self.lam[rec]]
+        beta = self.beta[self._file[rec]]
+        pr1 = beta * self._ah[rec]
+        pr0 = 1 - beta
+        if self.weighted:
+            # Every record of a row shares its z
+            with np.errstate(divide='ignore', over='ignore'):
+                pr = 1 / (1 + (pr0 / pr1) ** self.w[rec, None])
+        else:
+            total = pr1 + pr0
+            pr = np.where(total == 0, 0, pr1 / np.where(total == 0, 1, total))
+        draws = self.rng.random_sample(pr.shape) < pr
+        self.z[rec] = np.where(match, draws, 1)
+
+    def draw_Y(self, latents=None):
+        '''
+        Draws the fields of the occupied latents, or of just the given ones. A
+        latent linked to an undistorted record takes its value; a string
+        latent linked only to distorted records is drawn from
+        h * alpha * prod(ecd) (or from the prior if no value is within the
+        cutoff of all its records); anything else comes from the prior.
+        Empty latents are not drawn: draw_lambda integrates them out.
+
+        Records are visited grouped by latent through self.members, so each
+        field takes a single pass over the records.
+        '''
+        records, latent_of = self.members.records, self.members.latent_of
+        target = self.members.counts > 0
+        if latents is not None:
+            target = np.zeros(self.M, dtype=bool)
+            target[latents] = True
+        entries = target[latent_of]
+        records, latent_of = records[entries], latent_of[entries]
+        for l in range(self.p):
+            Y = self.Y[:, l]
+            # First undistorted record of each latent
+            undistorted = np.flatnonzero(self.z[records, l] == 0)
+            starts = np.ones(len(undistorted), dtype=bool)
+            starts[1:] = latent_of[undistorted[1:]] != latent_of[undistorted[:-1]]
+            first = undistorted[starts]
+            Y[latent_of[first]] = self.X[records[first], l]
+            todo = target.copy()
+            todo[latent_of[first]] = False
+
+            if l < self.ps:
+                positions = np.flatnonzero(todo[latent_of])
+                if len(positions):
+                    ids = np.flatnonzero(todo)
+                    groups = np.searchsorted(ids, latent_of[positions])
+                    group, value, phi = self.ecd[l].row_products(
+                     self.X[records[positions], l], groups, len(ids),
+                     self.w[records[positions]] if self.weighted else None)
+                    phi *= self.h[l][value] * self.alpha[l][value]
+                    found = np.bincount(group, weights=phi, minlength=len(ids)) > 0
+                    keep = found[group]
+                    pick = sample_segments(phi[keep], group[keep], len(ids), self.rng)
+                    Y[ids[found]] = value[keep][pick[found]]
+                    todo[ids[found]] = False
+
+            prior = np.flatnonzero(todo)
+            Y[prior] = sample_categorical(self.alpha[l], self.rng, len(prior))
+        self.index.update(self._indexed_Y())
+
+    def draw_lambda(self):
+        '''
+        Draws the latent for every record. An occupied latent is possible for
+        a record when it agrees with the record on every undistorted field;
+        possible latents are weighted by h * ecd over the distorted string
+        fields. The empty latents, whose fields would be fresh draws from the
+        prior, are scored together as one candidate weighted by their number
+        and the prior probability of agreeing. Records drawing it each take a
+        different empty latent, whose fields are then drawn given the record.
+        '''
+        rec = self._active_records()
+        X, z = self.X[rec], self.z[rec]
+        occupied = self.members.counts > 0
+        rows, latents = self.index.candidates(X, z, np.flatnonzero(occupied))
+        q = np.ones(len(rows))
+        for l in range(self.ps):
+            distorted = np.flatnonzero(z[rows, l] == 1)
+            x = X[rows[distorted], l]
+            y = self.Y[latents[distorted], l]
+            q[distorted] *= self.h[l][y] * self.ecd[l].lookup(x, y)
+        if self.weighted:
+            q **= self.w[rec][rows]
+        # Add the pool of empty latents as a last candidate for every record
+        pool = np.full(len(rec), float(self.M - occupied.sum()))
+        for l in range(self.p):
+            undistorted = z[:, l] == 0
+            pool[undistorted] *= self.alpha[l][X[undistorted, l]]
+            if l < self.ps:
+                pool[~undistorted] *= self._pool[l][rec[~undistorted]]
+        ends = np.searchsorted(rows, np.arange(len(rec)), side='right')
+        rows = np.insert(rows, ends, np.arange(len(rec)))
+        latents = np.insert(latents, ends, -1)
+        q = np.insert(q, ends, pool)
+        lam = self.lam.copy()
+        lam[rec] = latents[sample_segments(q, rows, len(rec), self.rng)]
+        new = np.flatnonzero(lam == -1)
+        if len(new):
+            taken = np.zeros(self.M, dtype=bool)
+            taken[lam[lam >= 0]] = True
+            lam[new] = np.flatnonzero(~taken)[:len(new)]
+        self.lam = lam
+        self.members.update(self.lam)
+        self.num_candidates = len(rows) - len(rec)
+        if len(new):
+            self.draw_Y(self.lam[new])
+        else:
+            self.index.update(self._indexed_Y())
+
+    def _active_records(self):
+        if self.active is None:
+            return np.arange(self.N)
+        return np.flatnonzero(self.active)
+
+    def _stream(self, *counter):
+        if self.streams is not None:
+            self.rng = self.streams.get(*counter)
+
+    def iterate(self, g=0):
+        '''
+        Runs iteration g, drawing each parameter in turn.
+        '''
+        self._stream('draw_beta', g)
+        with stage(self.profiler, 'draw_beta'):
+            self.draw_beta()
+        self._stream('draw_z', g)
+        with stage(self.profiler, 'draw_z'):
+            self.draw_z()
+        self._stream('draw_Y', g)
+        with stage(self.profiler, 'draw_Y'):
+            self.draw_Y()
+        self._stream('draw_lambda', g)
+        with stage(self.profiler, 'draw_lambda') as record:
+            self.draw_lambda()
+            record['candidates'] = self.num_candidates
+
+    def run(self, iterations, out=None, burn_in=0, thin=1, refresh=0,
+     checkpoint=None, checkpoint_every=0, resume=False, stopping=None):
+        '''
+        Runs the sampler. Returns the lambda history (kept iterations x N,
+        with latents numbered from 1 as in R) and the estimated population
+        size (number of distinct latents) at each kept iteration.
+
+        The first burn_in iterations are dropped and every thin-th iteration
+        is kept after that. If out is a filepath, the history is streamed to
+        it as a .npy file and returned as a read-only memory map.
+
+        If only some records are active, every record is drawn again during
+        the last refresh iterations.
+
+        If checkpoint is a filepath, the full state is saved there every
+        checkpoint_every iterations and at the end. With resume set, the run
+        continues from that checkpoint, if it exists, appending to the
+        history already streamed to out.
+
+        stopping is a diagnostics.StoppingRule. If given, the population size
+        trace is checked against it every stopping.check_every iterations and
+        the run ends as soon as it has converged, with self.stopped set to
+        the number of iterations run and the reason.
+        '''
+        start, est_pop, kept = 0, [], 0
+        self.stopped = None
+        if resume and checkpoint and os.path.exists(checkpoint):
+            start, est_pop, kept = self.load_checkpoint(checkpoint)
+            if stopping and start % stopping.check_every == 0:
+                converged, reason = stopping.converged([est_pop])
+                if converged:
+                    self.stopped = (start, reason)
+        rows = np.arange(self.N) if self.expand is None else self.expand
+        writer = LambdaWriter(out, len(rows), iterations, burn_in, thin, kept)
+        for g in range(start, iterations):
+            if self.stopped:
+                break
+            if g == iterations - refresh:
+                self.active = None
+            self.iterate(g)
+            if writer.keeps(g):
+                writer.add(g, self.lam[rows] + 1)
+                est_pop.append(np.count_nonzero(np.bincount(self.lam, minlength=self.M)))
+            if stopping and (g + 1) % stopping.check_every == 0:
+                converged, reason = stopping.converged([est_pop])
+                if converged:
+                    self.stopped = (g + 1, reason)
+            if checkpoint and ((checkpoint_every and (g + 1) % checkpoint_every == 0)
+             or g + 1 == iterations or self.stopped):
+                writer.flush()
+                self.save_checkpoint(checkpoint, g + 1, est_pop, writer.count)
+        return writer.close(), np.array(est_pop, dtype=np.int64)
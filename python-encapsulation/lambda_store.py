@@ -0,0 +1,104 @@
+# Storage for lambda draws from the Gibbs sampler.
+#
+# Draws are streamed to a binary .npy file of int32 rows, one row per kept
+# iteration, instead of being held in memory and written out as text. The
+# files are read back as memory maps so the history never has to be loaded
+# all at once.
+
+import numpy as np
+
+def kept_iterations(iterations, burn_in=0, thin=1):
+    '''
+    Number of draws kept out of iterations after dropping burn_in draws and
+    keeping every thin-th draw of the rest.
+    '''
+    return max(0, (iterations - burn_in + thin - 1) // thin)
+
+
+class LambdaWriter(object):
+    '''
+    Writes lambda draws to a .npy file, or to memory if path is None,
+    skipping burn-in and thinning as it goes. When resuming a run, start is
+    the number of draws already written to the file at path.
+    '''
+
+    def __init__(self, path, N, iterations, burn_in=0, thin=1, start=0):
+        self.path = path
+        self.burn_in = burn_in
+        self.thin = thin
+        shape = (kept_iterations(iterations, burn_in, thin), N)
+        if start and path is None:
+            raise ValueError('Only draws streamed to file can be resumed.')
+        if path is None:
+            self.out = np.empty(shape, dtype=np.int32)
+        elif start:
+            self.out = np.load(path, mmap_mode='r+')
+            if self.out.shape != shape:
+                raise ValueError('{} does not match this run.'.format(path))
+        else:
+            self.out = np.lib.format.open_memmap(path, mode='w+', dtype=np.int32,
+             shape=shape)
+        self.count = start
+
+    def keeps(self, g):
+        '''
+        Whether iteration g (counting from 0) is kept.
+        '''
+        return g >= self.burn_in and (g - self.burn_in) % self.thin == 0
+
+    def add(self, g, lam):
+        if self.keeps(g):
+            self.out[self.count] = lam
+            self.count += 1
+
+    def flush(self):
+        if self.path is not None:
+            self.out.flush()
+
+    def close(self):
+        '''
+        Finishes writing. Returns the draws, as a read-only memory map if they
+        were written to file. If the run stopped early, only the draws written
+        are returned.
+        '''
+        if self.path is None:
+            return self.out[:self.count]
+        self.out.flush()
+        del self.out
+        return np.load(self.path, mmap_mode='r')[:self.count]
+
+
+class LambdaHistory(object):
+    '''
+    Lambda draws from one or more chains over the same records. Each part is
+    an array, the path of a .npy file, which is memory-mapped, or a tuple of
+    such a path and the number of its rows holding draws.
+    '''
+
+    def __init__(self, parts):
+        self.parts = []
+        for x in parts:
+            if isinstance(x, basestring):
+                x = np.load(x, mmap_mode='r')
+            elif isinstance(x, tuple):
+                x = np.load(x[0], mmap_mode='r')[:x[1]]
+            self.parts.append(x)
+
+    def __len__(self):
+        return sum(len(x) for x in self.parts)
+
+    @property
+    def shape(self):
+        return (len(self), self.parts[0].shape[1])
+
+    def chunks(self, size):
+        '''
+        Yields the draws in blocks of at most size rows.
+        '''
+        for part in self.parts:
+            for start in range(0, len(part), size):
+                yield np.asarray(part[start:start + size])
+
+    def __array__(self, dtype=None):
+        rv = np.vstack([np.asarray(x) for x in self.parts])
+        return rv if dtype is None else rv.astype(dtype)
@@ -0,0 +1,170 @@
+# Index structures over the latent entities used by the numpy Gibbs sampler.
+
+import numpy as np
+
+REBUILD_FRACTION = 0.25 # Re-sort a field outright if more latents than this changed
+
+
+class InvertedIndex(object):
+    '''
+    Maps each field value to the latents currently holding it. Postings are
+    stored CSR style: for field l, the latents with value v are
+    order[l][offsets[l][v]:offsets[l][v + 1]].
+    '''
+
+    def __init__(self, Y, num_values):
+        self.Y = np.array(Y, dtype=np.int64)
+        self.M, self.p = self.Y.shape
+        self.num_values = list(num_values)
+        self.order = [None] * self.p
+        self.counts = [None] * self.p
+        self.offsets = [None] * self.p
+        for l in range(self.p):
+            self._rebuild(l)
+
+    def _rebuild(self, l):
+        col = self.Y[:, l]
+        self.order[l] = np.argsort(col, kind='mergesort')
+        self.counts[l] = np.bincount(col, minlength=self.num_values[l])
+        self._set_offsets(l)
+
+    def _set_offsets(self, l):
+        self.offsets[l] = np.concatenate([[0], np.cumsum(self.counts[l])])
+
+    def postings(self, l, v):
+        '''
+        Latents whose field l has value v.
+        '''
+        return self.order[l][self.offsets[l][v]:self.offsets[l][v + 1]]
+
+    def update(self, Y):
+        '''
+        Brings the index in line with a new draw of Y. Only latents whose value
+        changed are moved between posting lists.
+        '''
+        for l in range(self.p):
+            new = Y[:, l]
+            changed = np.flatnonzero(self.Y[:, l] != new)
+            if len(changed) == 0:
+                continue
+            old = self.Y[changed, l]
+            self.Y[changed, l] = new[changed]
+            if len(changed) > REBUILD_FRACTION * self.M:
+                self._rebuild(l)
+                continue
+            # Drop the moved latents, then insert them at the end of the
+            # posting list for their new value
+            keep = np.ones(self.M, dtype=bool)
+            keep[changed] = False
+            order = self.order[l][keep[self.order[l]]]
+            np.subtract.at(self.counts[l], old, 1)
+            np.add.at(self.counts[l], new[changed], 1)
+            values = new[changed]
+            by_value = np.argsort(values, kind='mergesort')
+            positions = np.searchsorted(self.Y[order, l], values[by_value], side='right')
+            self.order[l] = np.insert(order, positions, changed[by_value])
+            self._set_offsets(l)
+
+    def candidates(self, X, z, free=None):
+        '''
+        Finds the possible latents for each record: those agreeing with it on
+        every undistorted field. Each record starts from its shortest posting
+        list over the undistorted fields, which is then checked against the
+        others. Records with every field distorted may link to any latent in
+        free, which defaults to all of them.
+
+        Returns (rows, latents) pairs sorted by row.
+        '''
+        N = len(X)
+        sizes = np.empty((N, self.p), dtype=np.int64)
+        for l in range(self.p):
+            sizes[:, l] = np.where(z[:, l] == 0, self.counts[l][X[:, l]], self.M + 1)
+        pivot = np.argmin(sizes, axis=1)
+        pivot_size = sizes[np.arange(N), pivot]
+
+        rows = [np.empty(0, dtype=np.int64)]
+        latents = [np.empty(0, dtype=np.int64)]
+        if free is None:
+            free = np.arange(self.M)
+        unmatched = np.flatnonzero(pivot_size > self.M)
+        if len(unmatched):
+            rows.append(np.repeat(unmatched, len(free)))
+            latents.append(np.tile(free, len(unmatched)))
+        for l in range(self.p):
+            recs = np.flatnonzero((pivot == l) & (pivot_size <= self.M))
+            lengths = pivot_size[recs]
+            total = lengths.sum()
+            if total == 0:
+                continue
+            starts = self.offsets[l][X[recs, l]]
+            within = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            rows.append(np.repeat(recs, lengths))
+            latents.append(self.order[l][np.repeat(starts, lengths) + within])
+        rows = np.concatenate(rows)
+        latents = np.concatenate(latents)
+
+        ok = np.ones(len(rows), dtype=bool)
+        for l in range(self.p):
+            ok &= (z[rows, l] == 1) | (self.Y[latents, l] == X[rows, l])
+        rows = rows[ok]
+        latents = latents[ok]
+        by_row = np.argsort(rows, kind='mergesort')
+        return rows[by_row], latents[by_row]
+
+
+class LatentMembers(object):
+    '''
+    Maps each latent to the records linked to it. Stored CSR style: the
+    records of latent j are records[offsets[j]:offsets[j + 1]], in increasing
+    order, and latent_of holds the latent of each entry of records.
+    '''
+
+    def __init__(self, lam, M):
+        self.lam = np.array(lam, dtype=np.int64)
+        self.M = M
+        self._rebuild()
+
+    def _rebuild(self):
+        self.records = np.argsort(self.lam, kind='mergesort')
+        self.latent_of = self.lam[self.records]
+        self.counts = np.bincount(self.lam, minlength=self.M)
+        self._set_offsets()
+
+    def _set_offsets(self):
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def members(self, j):
+        '''
+        Records linked to latent j.
+        '''
+        return self.records[self.offsets[j]:self.offsets[j + 1]]
+
+    def update(self, lam):
+        '''
+        Brings the membership in line with a new draw of lambda. Only records
+        whose latent changed are moved.
+        '''
+        N = len(self.lam)
+        changed = np.flatnonzero(self.lam != lam)
+        if len(changed) == 0:
+            return
+        old = self.lam[changed]
+        new = lam[changed]
+        self.lam[changed] = new
+        if len(changed) > REBUILD_FRACTION * N:
+            self._rebuild()
+            return
+        moved = np.zeros(N, dtype=bool)
+        moved[changed] = True
+        keep = ~moved[self.records]
+        records = self.records[keep]
+        latent_of = self.latent_of[keep]
+        # Insert the moved records in (latent, record) order
+        keys = new * N + changed
+        by_key = np.argsort(keys)
+        positions = np.searchsorted(latent_of * N + records, keys[by_key])
+        self.records = np.insert(records, positions, changed[by_key])
+        self.latent_of = np.insert(latent_of, positions, new[by_key])
+        np.subtract.at(self.counts, old, 1)
+        np.add.at(self.counts, new, 1)
+        self._set_offsets()
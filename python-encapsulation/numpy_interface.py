@@ -0,0 +1,112 @@
+# Python interface for running ebLink without R.
+#
+# Mirrors R_interface.py, but runs the Gibbs sampler from gibbs_sampler.py on
+# integer coded fields (see records.py) instead of calling rl.gibbs through
+# rpy2, and summarises the draws with posterior.py instead of analyzeGibbs.R.
+
+import numpy as np
+import pandas as pd
+from gibbs_sampler import GibbsSampler, STEEPNESS
+from posterior import links, pairwise
+from profiling import Profiler
+
+def load_records(tmp, column_types):
+    '''
+    Reads the tmp csv and integer codes each linking column. Returns the code
+    matrix (string fields first, then categorical), the number of string
+    fields and the distinct values behind the codes of each string field.
+    '''
+    data = pd.read_csv(tmp, dtype=str, keep_default_na=False)
+    s_cols = [x for x in column_types if column_types[x].upper() == 'S']
+    c_cols = [x for x in column_types if column_types[x].upper() == 'C']
+    X = np.empty((len(data), len(s_cols) + len(c_cols)), dtype=np.int64)
+    values = []
+    for l, col in enumerate(s_cols + c_cols):
+        codes, uniques = pd.factorize(data[col], sort=True)
+        X[:, l] = codes
+        if col in s_cols:
+            values.append(list(uniques))
+    return X, len(s_cols), values
+
+def run_eblink(records, tmp_dir, column_types, a, b, iterations, filenum,
+ numrecords, cutoff=None, cache_dir=None, out=None, burn_in=0, thin=1,
+ init=None, active=None, refresh=0, state_file=None, checkpoint=None,
+ checkpoint_every=0, resume=False, stopping=None, profile=None, priors=None,
+ seed=None, streams=None, scatter=False, weights=None, expand=None):
+    '''
+    Runs the numpy Gibbs sampler. Takes the same inputs and returns the same
+    outputs as R_interface.run_eblink, the lambda history and the estimated
+    population size at each iteration, plus the number of iterations run,
+    which is fewer than iterations if stopping ended the run. records is
+    either the path of a csv of the records or the (X, num_string, values)
+    codes from RecordStore.matrix.
+
+    cutoff is the largest edit distance given weight between strings, and
+    cache_dir a directory for caching string distance kernels. If out is a
+    filepath, the lambda history is streamed to it as a .npy file and
+    returned as a memory map. burn_in and thin drop early iterations and keep
+    every thin-th one after.
+
+    init is a sampler state (see GibbsSampler.set_state) to start from, and
+    active a mask of the records to draw, the rest keeping their links from
+    init until the last refresh iterations. If state_file is given, the final
+    state is saved there as a .npz file.
+
+    checkpoint, checkpoint_every and resume are passed on to
+    GibbsSampler.run to save the sampler state periodically and continue an
+    interrupted run from it. stopping is a diagnostics.StoppingRule for
+    ending the run once it has converged. If profile is a filepath, the time
+    taken by the distance computations and each sampler step is logged to it
+    as JSON lines (see profiling.py). priors holds (alpha, h) for each
+    field from shared prior tables (see priors.py), indexed by code.
+
+    seed seeds the sampler's random numbers, or streams, an rng.Streams,
+    gives each step of each iteration its own. If scatter is set, the chain
+    starts from a random state (see GibbsSampler.scatter) instead of from
+    the data.
+
+    weights and expand are set when records holds distinct rows standing
+    for several identical records (see records.collapse): weights is the
+    number of records of each row and expand the row of each record. The
+    lambda history and saved state are expanded back to the records.
+    '''
+    if isinstance(records, basestring):
+        X, ps, values = load_records(records, column_types)
+    else:
+        X, ps, values = records
+    print 'Running the gibbs sampler...'
+    profiler = Profiler(profile) if profile else None
+    try:
+        sampler = GibbsSampler(X, filenum, ps, a, b, values=values, c=STEEPNESS,
+         M=numrecords, seed=seed, streams=streams, cutoff=cutoff,
+         cache_dir=cache_dir, profiler=profiler, priors=priors,
+         weights=weights, expand=expand)
+        if init is not None:
+            sampler.set_state(init)
+            sampler.active = active
+        elif scatter:
+            sampler.scatter()
+        lam, est_pop = sampler.run(iterations, out, burn_in, thin, refresh,
+         checkpoint, checkpoint_every, resume, stopping)
+    finally:
+        if profiler:
+            profiler.close()
+    run = iterations
+    if sampler.stopped:
+        run = sampler.stopped[0]
+        print 'Converged after {} iterations: {}'.format(*sampler.stopped)
+    if state_file:
+        state = sampler.get_state()
+        if expand is not None:
+            state['z'] = state['z'][expand]
+            state['lam'] = state['lam'][expand]
+        np.savez(state_file, **state)
+    return lam, est_pop, run
+
+def calc_linkages(linkage):
+    '''
+    Finds Maximal Matching Sets (MMS) from the lambda history and returns
+    pairs of entries that have been matched, numbered by their position in
+    the tmp file from 1. Gives the same pairs as R_interface.calc_linkages.
+    '''
+    return np.array(pairwise(links(linkage)))
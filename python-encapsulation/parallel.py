@@ -0,0 +1,56 @@
+# Parallel execution of ebLink runs.
+#
+# Independent units of work (blocks, or chains of the same block) are run in a
+# pool of worker processes, each with its own backend, or sent to long-lived
+# workers (see worker.py) that have loaded their backends already. On Python
+# 2 the pool needs the futures backport of concurrent.futures.
+
+import numpy as np
+from lambda_store import LambdaHistory
+
+def run_unit(unit):
+    '''
+    Runs a single sampler. unit is a tuple of (backend, args, kwargs), where
+    args and kwargs are passed on to the backend's run_eblink. Returns the
+    lambda history, the estimated population size at each iteration and the
+    number of iterations run.
+    '''
+    backend, args, kwargs = unit
+    if backend == 'numpy':
+        import numpy_interface as ri
+    else:
+        import R_interface as ri
+    rv = ri.run_eblink(*args, **kwargs)
+    lam, est_pop = rv[:2]
+    # R always runs every iteration, args[5]
+    run = rv[2] if len(rv) > 2 else args[5]
+    # Hand back the file rather than the draws for histories streamed to disk
+    if isinstance(lam, np.memmap):
+        lam = (lam.filename, len(lam))
+    return lam, est_pop, run
+
+def run_units(units, workers=1, addresses=None, authkey=None):
+    '''
+    Runs every unit, fanning them out over a process pool when workers is
+    more than 1, or over the running workers at addresses if given. Returns
+    the results in the same order as units.
+    '''
+    if addresses:
+        from worker import run_remote
+        return run_remote(units, addresses, authkey)
+    if workers == 1 or len(units) == 1:
+        return [run_unit(unit) for unit in units]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_unit, units))
+
+def merge_chains(results):
+    '''
+    Joins the results of several chains run on the same records. The lambda
+    histories are chained into one LambdaHistory, as the linkage summaries
+    only compare latents within an iteration, and the population size traces
+    are concatenated.
+    '''
+    lam = LambdaHistory([x[0] for x in results])
+    est_pop = np.concatenate([x[1] for x in results])
+    return lam, est_pop
@@ -0,0 +1,112 @@
+# Posterior summaries of ebLink's lambda draws.
+#
+# A port of links, mpmms and pairwise in ebLink-master/R/code/analyzeGibbs.R.
+# Instead of recounting every record's maximal matching set (MMS) over all
+# iterations, each iteration is read once: every cluster of records sharing a
+# latent gets a signature (the sum of random 64-bit keys of its members), and
+# the occurrences of each (record, signature) pair are counted.
+
+import numpy as np
+
+CHUNK_CELLS = 2 ** 22 # Max iteration x record cells summarised at once
+
+
+def _cluster_signatures(lam, keys):
+    '''
+    For one iteration of lambda, returns the signature, size and smallest
+    member of each record's MMS.
+    '''
+    order = np.argsort(lam, kind='mergesort')
+    starts = np.flatnonzero(np.diff(np.concatenate([[-1], lam[order]])))
+    sizes = np.diff(np.append(starts, len(lam)))
+    sig = np.empty(len(lam), dtype=np.uint64)
+    size = np.empty(len(lam), dtype=np.int64)
+    first = np.empty(len(lam), dtype=np.int64)
+    sig[order] = np.repeat(np.add.reduceat(keys[order], starts), sizes)
+    size[order] = np.repeat(sizes, sizes)
+    # order is stable, so the first member of each cluster is its smallest
+    first[order] = np.repeat(order[starts], sizes)
+    return sig, size, first
+
+def _collapse(table):
+    '''
+    Sums the counts of rows of table with the same record and signature,
+    keeping the earliest iteration each was seen in.
+    '''
+    rec, sig, count, seen, size, first = table
+    order = np.lexsort((seen, sig, rec))
+    rec, sig, count, seen, size, first = [x[order] for x in table]
+    new = np.ones(len(rec), dtype=bool)
+    new[1:] = (rec[1:] != rec[:-1]) | (sig[1:] != sig[:-1])
+    starts = np.flatnonzero(new)
+    return (rec[starts], sig[starts], np.add.reduceat(count, starts), seen[starts],
+     size[starts], first[starts])
+
+def mpmms(lam_gs):
+    '''
+    Finds every record's most probable MMS in a single pass over the draws.
+    lam_gs is an iterations x N array or a LambdaHistory. Returns, for each
+    record, the probability of its MPMMS, its size, its smallest member and
+    an iteration in which it occurs. Ties go to the MMS seen first, as in R.
+    '''
+    G, N = lam_gs.shape
+    keys = np.frombuffer(np.random.RandomState(0).bytes(8 * N), dtype=np.uint64)
+    if hasattr(lam_gs, 'chunks'):
+        chunks = lam_gs.chunks(max(1, CHUNK_CELLS // N))
+    else:
+        step = max(1, CHUNK_CELLS // N)
+        chunks = (np.asarray(lam_gs[i:i + step]) for i in range(0, G, step))
+
+    table = None
+    g = 0
+    for chunk in chunks:
+        parts = [[] for _ in range(6)]
+        for lam in chunk:
+            sig, size, first = _cluster_signatures(lam, keys)
+            for part, x in zip(parts, [np.arange(N), sig, np.ones(N, dtype=np.int64),
+             np.full(N, g, dtype=np.int64), size, first]):
+                part.append(x)
+            g += 1
+        parts = [np.concatenate(x) for x in parts]
+        if table is not None:
+            parts = [np.concatenate([x, y]) for x, y in zip(table, parts)]
+        table = _collapse(parts)
+
+    # Keep the most frequent MMS of each record, earliest first on ties
+    rec, sig, count, seen, size, first = table
+    order = np.lexsort((seen, -count, rec))
+    best = order[np.flatnonzero(np.diff(np.concatenate([[-1], rec[order]])))]
+    return count[best] / float(G), size[best], first[best], seen[best]
+
+def _read_row(lam_gs, g):
+    if hasattr(lam_gs, 'parts'):
+        for part in lam_gs.parts:
+            if g < len(part):
+                return np.asarray(part[g])
+            g -= len(part)
+    return np.asarray(lam_gs[g])
+
+def links(lam_gs):
+    '''
+    Returns the estimated links: every MPMMS with more than one member and
+    probability above 0.5, as a list of arrays of records numbered from 1.
+    Same as links(lam.gs) in R with the default settings.
+    '''
+    prob, size, first, seen = mpmms(lam_gs)
+    records = np.flatnonzero((size > 1) & (prob > 0.5) & (first == np.arange(len(prob))))
+    rv = []
+    for g in np.unique(seen[records]):
+        lam = _read_row(lam_gs, g)
+        for r in records[seen[records] == g]:
+            rv.append(np.flatnonzero(lam == lam[r]) + 1)
+    return sorted(rv, key=lambda x: x[0])
+
+def pairwise(links):
+    '''
+    Splits 3-way, 4-way, etc. links into every pair they contain.
+    '''
+    rv = []
+    for link in links:
+        a, b = np.triu_indices(len(link), 1)
+        rv += zip(link[a], link[b])
+    return rv
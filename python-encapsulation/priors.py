@@ -0,0 +1,142 @@
+# Shared empirical prior tables for ebLink.
+#
+# The sampler's prior on each field is the empirical distribution alpha of its
+# values, and each string field also needs the normalizers
+# h(w) = 1 / sum_v alpha(v) exp(-c * d(w, v)). rl.gibbs recomputes both on
+# every call, over just the records it is given. A PriorTable instead holds
+# them for a field over a reference corpus, so they are computed once and
+# reused by every block and every run linking against the same population.
+# Tables are saved as versioned .npz files named by field and by a hash of the
+# value dictionary, c and cutoff.
+
+import glob
+import hashlib
+import os
+import numpy as np
+from distance import DistanceKernel, pair_distances
+
+FORMAT_VERSION = 1
+
+
+class PriorTable(object):
+    '''
+    The reference counts of each distinct value of a field and, for string
+    fields, the normalizers h under steepness c and distance cutoff.
+    '''
+
+    def __init__(self, field, values, counts, h=None, c=1, cutoff=None):
+        self.field = field
+        self.values = list(values)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.h = None if h is None else np.asarray(h, dtype=float)
+        self.c = c
+        self.cutoff = cutoff
+        self.total = float(self.counts.sum())
+        self.alpha = self.counts / self.total
+        self._lookup = dict((v, i) for i, v in enumerate(self.values))
+
+    @property
+    def key(self):
+        return hashlib.sha1(repr((self.c, self.cutoff, self.values))).hexdigest()
+
+    @classmethod
+    def build(cls, field, values, codes, string=False, c=1, cutoff=None,
+     cache_dir=None):
+        '''
+        Counts codes, which index values, and computes h for string fields.
+        String distance kernels are cached in cache_dir, if given.
+        '''
+        counts = np.bincount(codes, minlength=len(values))
+        h = None
+        if string:
+            kernel = DistanceKernel.build(values, c, cutoff, cache_dir)
+            h = kernel.normalizers(counts / float(counts.sum()))
+        return cls(field, values, counts, h, c, cutoff)
+
+    def align(self, values):
+        '''
+        alpha and h (None for categorical fields) for a list of values, such
+        as the value dictionary of one block. Values missing from the
+        reference count as seen once.
+        '''
+        pos = np.array([self._lookup.get(v, -1) for v in values], dtype=np.int64)
+        unseen = pos < 0
+        alpha = np.where(unseen, 1 / self.total, self.alpha[pos])
+        if self.h is None:
+            return alpha, None
+        h = np.empty(len(values))
+        h[~unseen] = self.h[pos[~unseen]]
+        for i in np.flatnonzero(unseen):
+            h[i] = self._normalizer(values[i])
+        return alpha, h
+
+    def _normalizer(self, value):
+        '''
+        h for a value outside the reference, against every reference value.
+        '''
+        n = len(self.values)
+        d = pair_distances(self.values + [value], np.full(n, n), np.arange(n))
+        weight = np.exp(-self.c * d.astype(float))
+        if self.cutoff is not None:
+            weight[d > self.cutoff] = 0
+        return 1.0 / (weight.dot(self.alpha) + 1 / self.total)
+
+    def save(self, directory):
+        '''
+        Saves the table in directory. Returns the filepath.
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, 'prior-{}-{}.npz'.format(self.field, self.key))
+        arrays = {'version': FORMAT_VERSION, 'field': self.field,
+         'values': np.array(self.values, dtype=object), 'counts': self.counts,
+         'c': self.c, 'cutoff': -1 if self.cutoff is None else self.cutoff}
+        if self.h is not None:
+            arrays['h'] = self.h
+        np.savez(path, **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Loads a table saved with save.
+        '''
+        data = np.load(path, allow_pickle=True)
+        if int(data['version']) != FORMAT_VERSION:
+            raise ValueError('{} has prior table version {}, not {}.'.format(
+             path, int(data['version']), FORMAT_VERSION))
+        cutoff = int(data['cutoff'])
+        return cls(str(data['field']), list(data['values']), data['counts'],
+         data['h'] if 'h' in data else None, data['c'].item(),
+         None if cutoff < 0 else cutoff)
+
+
+def build_priors(store, column_types, c=1, cutoff=None, cache_dir=None):
+    '''
+    Builds a PriorTable for every linking field of a RecordStore, such as
+    one loaded from a reference corpus. Returns a dict of field to table.
+    '''
+    return dict((f, PriorTable.build(f, store.values[f], store.codes[f],
+     column_types[f].upper() == 'S', c, cutoff, cache_dir))
+     for f in store.sampler_fields(column_types))
+
+def save_priors(tables, directory):
+    '''
+    Saves a dict of tables in directory.
+    '''
+    for table in tables.values():
+        table.save(directory)
+
+def load_priors(directory):
+    '''
+    Loads the tables saved in directory, one per field. Returns a dict of
+    field to table.
+    '''
+    rv = {}
+    for path in sorted(glob.glob(os.path.join(directory, 'prior-*.npz'))):
+        table = PriorTable.load(path)
+        if table.field in rv:
+            raise ValueError('More than one prior table for {} in {}.'.format(
+             table.field, directory))
+        rv[table.field] = table
+    return rv
@@ -0,0 +1,140 @@
+# Timing and resource instrumentation for ebLink runs.
+#
+# Each stage of a run (building the record store, computing string distances,
+# every step of every Gibbs iteration, finding links, building the crosswalk)
+# is timed as a record holding its wall time, the process's peak memory and
+# any counts of interest. Records are totalled by stage, and can also be
+# appended to a JSON-lines log or passed to a callback as they are made. The
+# log is kept open and flushed as each outermost stage ends, so profiling
+# every sampler step doesn't reopen it for every record.
+
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# Fields of a record that are not summed across calls of a stage
+_NOT_SUMMED = ('stage', 'max_rss_mb', 'block', 'chain')
+
+def peak_memory():
+    '''
+    Peak resident memory of this process so far, in MB.
+    '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and kilobytes elsewhere
+    return rss / 1024. ** (2 if sys.platform == 'darwin' else 1)
+
+
+class Profiler(object):
+    '''
+    Totals the records of each stage in metrics, a dict of stage name to
+    the number of calls, seconds taken, peak memory and summed counts. If
+    log is a filepath, every record is also appended to it as a line of
+    JSON, and callback, if given, is called with every record.
+    '''
+
+    def __init__(self, log=None, callback=None):
+        self.metrics = {}
+        self.log = log
+        self.callback = callback
+        self._file = None # The open log, once a record has been written
+        self._depth = 0 # Number of stages running
+
+    def __getstate__(self):
+        # Callbacks often can't be pickled, so they are left behind, as is
+        # the open log, which is reopened when next written
+        self.flush()
+        state = self.__dict__.copy()
+        state['callback'] = None
+        state['_file'] = None
+        return state
+
+    def flush(self):
+        '''
+        Writes out records held in the log's buffer.
+        '''
+        if self._file:
+            self._file.flush()
+
+    def close(self):
+        '''
+        Flushes and closes the log. It is reopened if more records are added.
+        '''
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    @contextmanager
+    def stage(self, name, **counts):
+        '''
+        Times the enclosed code as a call of stage name. Yields the record, to
+        which more counts can be added.
+        '''
+        record = {'stage': name}
+        record.update(counts)
+        start = time.time()
+        self._depth += 1
+        try:
+            yield record
+        finally:
+            self._depth -= 1
+            record['seconds'] = time.time() - start
+            record['max_rss_mb'] = peak_memory()
+            self.add(record)
+
+    def add(self, record):
+        '''
+        Adds a finished record to the totals of its stage, logs it and passes
+        it to the callback.
+        '''
+        totals = self.metrics.setdefault(record['stage'], {'calls': 0})
+        totals['calls'] += record.get('calls', 1)
+        for key, value in record.items():
+            if key in _NOT_SUMMED or key == 'calls':
+                continue
+            if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                totals[key] = totals.get(key, 0) + value
+            else:
+                totals[key] = value
+        if 'max_rss_mb' in record:
+            totals['max_rss_mb'] = max(totals.get('max_rss_mb', 0), record['max_rss_mb'])
+        if self.log:
+            if self._file is None:
+                self._file = open(self.log, 'a')
+            self._file.write(json.dumps(record) + '\n')
+            if not self._depth:
+                self._file.flush()
+        if self.callback:
+            self.callback(record)
+
+    def read_log(self, filename, **tags):
+        '''
+        Adds every record in a JSON-lines log written by another profiler,
+        such as one in a worker process, tagging each with tags.
+        '''
+        # Hold the records in the buffer until all are added
+        self._depth += 1
+        try:
+            with open(filename, 'r') as f:
+                for line in f:
+                    record = dict((str(k), v) for k, v in json.loads(line).items())
+                    record['stage'] = str(record['stage'])
+                    record.update(tags)
+                    self.add(record)
+        finally:
+            self._depth -= 1
+            self.flush()
+
+
+@contextmanager
+def stage(profiler, name, **counts):
+    '''
+    Profiler.stage if profiler is given; otherwise just yields a record that
+    is thrown away.
+    '''
+    if profiler is None:
+        yield dict(counts)
+    else:
+        with profiler.stage(name, **counts) as record:
+            yield record
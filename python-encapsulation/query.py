@@ -0,0 +1,211 @@
+# Matching single records against a linked population.
+#
+# A MatchIndex holds the entities found by a finished run, one per crosswalk
+# cluster, each summarised by the most common value of every field among its
+# records. An incoming record is scored against the entities that agree with
+# it on most fields, using the ebLink likelihood: each field of the record is
+# either copied from the entity (probability 1 - beta) or distorted
+# (probability beta), in which case it is drawn from alpha, weighted by
+# h * exp(-c * d) for string fields. A record may also belong to an entity
+# not yet seen, weighted by the number of unused latents as in the sampler.
+# Scores are normalised over the candidates into posterior probabilities.
+
+import numpy as np
+from distance import DistanceKernel, pair_distances
+from gibbs_sampler import STEEPNESS
+
+NEW_ENTITY = -1 # Cluster returned for the chance a record is of a new entity
+
+def _modes(clusters, codes, num_clusters):
+    '''
+    The most common code of each cluster, the smallest on ties.
+    '''
+    base = codes.max() + 1
+    keys, counts = np.unique(clusters.astype(np.int64) * base + codes,
+     return_counts=True)
+    order = np.lexsort((-counts, keys // base))
+    cluster = (keys // base)[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = cluster[1:] != cluster[:-1]
+    rv = np.empty(num_clusters, dtype=np.int64)
+    rv[cluster[first]] = (keys % base)[order][first]
+    return rv
+
+
+class MatchIndex(object):
+    '''
+    Entities and model parameters of a finished run, indexed by field value
+    for scoring new records. Build one with from_eblink.
+    '''
+
+    def __init__(self, fields, num_string, values, alpha, h, kernels, unseen,
+     entities, beta, num_latents, c=STEEPNESS, cutoff=None, blocking=None,
+     entity_blocks=None, block_ids=None):
+        '''
+        fields are the linking fields, string fields first, and values,
+        alpha, h and kernels the distinct values, their prior probabilities,
+        normalizers and DistanceKernel of each (h and kernels for string
+        fields only), and unseen the prior probability of a value missing
+        from values, as if seen once. entities holds the value code of each
+        field for every entity, beta the distortion probability of each
+        field and num_latents the number of latent entities in the model. If
+        the run was blocked, blocking, the block of each entity and the
+        block_ids of each key restrict matches to the record's block.
+        '''
+        self.fields = list(fields)
+        self.ps = num_string
+        self.values = values
+        self.alpha = alpha
+        self.h = h
+        self.kernels = kernels
+        self.unseen = unseen
+        self.entities = np.asarray(entities, dtype=np.int64)
+        self.beta = np.asarray(beta, dtype=float)
+        self.num_latents = num_latents
+        self.c = c
+        self.cutoff = cutoff
+        self.blocking = blocking
+        self.entity_blocks = entity_blocks
+        self.block_ids = block_ids
+        self._lookup = [dict((v, i) for i, v in enumerate(x)) for x in values]
+        # sum_y alpha(y) h(y) ecd(x, y) for each string value x
+        self._spread = [kernels[l].matrix.dot(alpha[l] * h[l]) for l in range(self.ps)]
+        # Entities holding each value, CSR style as in InvertedIndex
+        self._order = []
+        self._offsets = []
+        for l in range(len(self.fields)):
+            col = self.entities[:, l]
+            self._order.append(np.argsort(col, kind='mergesort'))
+            self._offsets.append(np.concatenate([[0],
+             np.cumsum(np.bincount(col, minlength=len(values[l])))]))
+
+    @classmethod
+    def from_eblink(cls, link):
+        '''
+        Builds the index from an EBlink after build_crosswalk. Its prior
+        tables are used if set; otherwise the priors are computed from its
+        records, as the sampler does. beta is the mean of the final draws of
+        the numpy backend, or the prior mean without them.
+        '''
+        if link.crosswalk is None:
+            raise ValueError('Build the crosswalk before the match index.')
+        store = link._records
+        fields = store.sampler_fields(link.column_types)
+        ps = len([f for f in fields if link.column_types[f].upper() == 'S'])
+        clusters = np.asarray(link.crosswalk.cluster.values, dtype=np.int64)
+        num_clusters = clusters.max() + 1 if len(clusters) else 0
+        values, alpha, h, kernels, unseen, entities = [], [], [], [], [], []
+        for l, f in enumerate(fields):
+            values.append(list(store.values[f]))
+            codes = np.asarray(store.codes[f])
+            if link._priors:
+                a, b = link._priors[f].align(values[l])
+                unseen.append(1 / link._priors[f].total)
+            else:
+                unseen.append(1.0 / len(codes))
+                a, b = np.bincount(codes, minlength=len(values[l])) / float(len(codes)), None
+            if l < ps:
+                kernels.append(DistanceKernel.build(values[l], STEEPNESS,
+                 link.distance_cutoff, link.distance_cache))
+                if b is None:
+                    b = kernels[l].normalizers(a)
+                h.append(b)
+            alpha.append(a)
+            entities.append(_modes(clusters, codes, num_clusters))
+        if link._states:
+            beta = np.mean(np.concatenate([x['beta'] for x in link._states.values()]), axis=0)
+        else:
+            beta = np.full(len(fields), link.alpha / float(link.alpha + link.beta))
+        entity_blocks = None
+        if link._blocks is not None:
+            entity_blocks = np.empty(num_clusters, dtype=np.int64)
+            entity_blocks[clusters] = link._blocks
+        return cls(fields, ps, values, alpha, h, kernels, unseen,
+         np.column_stack(entities), beta, link._numrecords, STEEPNESS,
+         link.distance_cutoff, link._blocking, entity_blocks, link._block_ids)
+
+    def _kernel(self, l, x, code, y):
+        '''
+        exp(-c * d(x, y)) for string field l between value x (with code, or
+        -1 if unseen) and the value codes y.
+        '''
+        if code >= 0:
+            return self.kernels[l].lookup(np.full(len(y), code), y)
+        values = [x] + [self.values[l][i] for i in y]
+        d = pair_distances(values, np.zeros(len(y), dtype=np.int64), np.arange(1, len(y) + 1))
+        rv = np.exp(-self.c * d.astype(float))
+        if self.cutoff is not None:
+            rv[d > self.cutoff] = 0
+        return rv
+
+    def _prior(self, l, code):
+        '''
+        alpha for a value code of field l, or for an unseen value if -1.
+        '''
+        if code >= 0:
+            return self.alpha[l][code]
+        return self.unseen[l]
+
+    def candidates(self, codes, max_disagree=2):
+        '''
+        Entities agreeing with a record's value codes (-1 for unseen values)
+        on all but at most max_disagree fields.
+        '''
+        found = [self._order[l][self._offsets[l][x]:self._offsets[l][x + 1]]
+         for l, x in enumerate(codes) if x >= 0]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        entities, agree = np.unique(np.concatenate(found), return_counts=True)
+        return entities[agree >= len(self.fields) - max_disagree]
+
+    def query(self, record, top=5, max_disagree=2):
+        '''
+        Scores a record, a dict of field to value, against the entities.
+        Returns up to top (cluster, probability) pairs, most likely first,
+        where the cluster is that of the crosswalk or NEW_ENTITY for the
+        chance the record is of an entity not yet linked. Only entities
+        agreeing with the record on all but max_disagree fields are scored.
+        '''
+        x = [record[f] if isinstance(record[f], basestring) else str(record[f])
+         for f in self.fields]
+        codes = [self._lookup[l].get(v, -1) for l, v in enumerate(x)]
+        entities = self.candidates(codes, max_disagree)
+        if self.blocking is not None and len(entities):
+            block = self.block_ids.get(self.blocking.key(record))
+            entities = entities[self.entity_blocks[entities] == block]
+
+        score = np.zeros(len(entities))
+        new = np.log(max(self.num_latents - len(self.entities), 1))
+        for l in range(len(self.fields)):
+            y = self.entities[entities, l]
+            prior = self._prior(l, codes[l])
+            same = (1 - self.beta[l]) * (y == codes[l])
+            if l < self.ps:
+                kernel = self._kernel(l, x[l], codes[l], y)
+                distorted = self.beta[l] * prior * self.h[l][y] * kernel
+                if codes[l] >= 0:
+                    spread = self._spread[l][codes[l]]
+                else:
+                    spread = self._kernel(l, x[l], -1, np.arange(len(self.values[l]))).dot(
+                     self.alpha[l] * self.h[l])
+                new += np.log(prior * ((1 - self.beta[l]) + self.beta[l] * spread))
+            else:
+                distorted = self.beta[l] * prior
+                new += np.log(prior)
+            with np.errstate(divide='ignore'):
+                score += np.log(same + distorted)
+
+        clusters = np.append(entities, NEW_ENTITY)
+        score = np.append(score, new)
+        prob = np.exp(score - score.max())
+        prob /= prob.sum()
+        best = np.argsort(-prob, kind='mergesort')[:top]
+        return [(int(clusters[i]), float(prob[i])) for i in best]
+
+    def query_many(self, records, top=5, max_disagree=2):
+        '''
+        Runs query on each record in a list of dicts or a DataFrame.
+        '''
+        if hasattr(records, 'to_dict'):
+            records = records.to_dict('records')
+        return [self.query(record, top, max_disagree) for record in records]
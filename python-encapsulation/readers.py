@@ -0,0 +1,107 @@
+# Chunked readers for ebLink's input files.
+#
+# Each reader streams a source in DataFrames of at most chunk_rows rows,
+# holding only the requested columns as strings, so files far larger than
+# memory and with many unused columns can be fed into the record store.
+# Supported sources are csv files (plain, .gz or .bz2), Parquet files (read
+# by row group, which needs pyarrow) and pandas DataFrames. Anything else is
+# handed to a fallback iterator of rows, such as EBlink.read_iterator.
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 100000 # Default number of rows per chunk
+
+def _as_strings(frame):
+    '''
+    Makes every column strings, with missing values as empty strings, as
+    they would be read from a csv.
+    '''
+    for col in frame.columns:
+        values = frame[col]
+        filled = values.notnull()
+        if values.dtype == object and filled.all():
+            continue
+        strings = values.astype(str)
+        if values.dtype.kind == 'f':
+            # Integer columns with missing values are float; write whole
+            # numbers without the .0, as a csv holds them
+            whole = filled & (values % 1 == 0)
+            strings[whole] = values[whole].astype(np.int64).astype(str)
+        frame[col] = strings.where(filled, '')
+    return frame
+
+def read_csv(filepath, columns, chunk_rows=CHUNK_ROWS):
+    '''
+    Streams the columns of a csv, decompressing .gz and .bz2 files on the fly.
+    '''
+    for chunk in pd.read_csv(filepath, usecols=columns, dtype=str,
+     keep_default_na=False, chunksize=chunk_rows, compression='infer'):
+        yield chunk[columns]
+
+def read_parquet(filepath, columns, chunk_rows=CHUNK_ROWS):
+    '''
+    Streams the columns of a Parquet file one row group at a time, split
+    further into chunks of chunk_rows.
+    '''
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Reading Parquet files needs pyarrow: pip install pyarrow')
+    f = pq.ParquetFile(filepath)
+    for i in range(f.num_row_groups):
+        group = f.read_row_group(i, columns=columns).to_pandas()
+        for chunk in read_frame(group, columns, chunk_rows):
+            yield chunk
+
+def read_frame(frame, columns, chunk_rows=CHUNK_ROWS):
+    '''
+    Streams the columns of a DataFrame.
+    '''
+    for start in range(0, len(frame), chunk_rows):
+        yield _as_strings(frame[columns].iloc[start:start + chunk_rows].copy())
+
+def read_rows(rows, columns, chunk_rows=CHUNK_ROWS):
+    '''
+    Streams the columns of an iterator of rows whose first row holds the
+    headers, like those from EBlink.read_iterator.
+    '''
+    headers = list(next(rows))
+    indices = [headers.index(col) for col in columns]
+    chunk = []
+    for row in rows:
+        chunk.append([row[i] for i in indices])
+        if len(chunk) == chunk_rows:
+            yield _as_strings(pd.DataFrame(chunk, columns=columns))
+            chunk = []
+    if chunk:
+        yield _as_strings(pd.DataFrame(chunk, columns=columns))
+
+def read_chunks(source, columns, chunk_rows=CHUNK_ROWS, fallback=None):
+    '''
+    Streams the given columns of source in DataFrames of at most chunk_rows
+    rows. source is a DataFrame or a filepath; csv and Parquet files are
+    recognised by name. Other sources are passed to fallback, which must
+    return an iterator of rows starting with the headers and a file to close
+    (or None).
+    '''
+    if isinstance(source, pd.DataFrame):
+        return read_frame(source, columns, chunk_rows)
+    if isinstance(source, basestring):
+        name = source.lower()
+        if name.endswith('.parquet') or name.endswith('.pq'):
+            return read_parquet(source, columns, chunk_rows)
+        if 'csv' in name:
+            return read_csv(source, columns, chunk_rows)
+    if fallback is None:
+        raise NameError('This file type or connection is not yet supported.')
+    return _read_fallback(source, columns, chunk_rows, fallback)
+
+def _read_fallback(source, columns, chunk_rows, fallback):
+    rows, f = fallback(source)
+    try:
+        for chunk in read_rows(rows, columns, chunk_rows):
+            yield chunk
+    finally:
+        if f:
+            f.close()
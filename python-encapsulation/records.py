@@ -0,0 +1,169 @@
+# Columnar record store for ebLink.
+#
+# Holds the linking fields of every record across all files, dictionary
+# encoded: one integer array of codes per field plus the distinct values
+# behind the codes, alongside the file number and UID of each record. Records
+# are numbered by ETL_ID - 1.
+
+import numpy as np
+import pandas as pd
+
+
+class RecordStore(object):
+
+    def __init__(self, fields):
+        self.fields = list(fields) # Linking columns, named as in the first file
+        self.codes = {} # Maps each field to an array of codes, one per record
+        self.values = {} # Maps each field to the distinct values, indexed by code
+        self.filenum = np.empty(0, dtype=np.int32) # File number of each record
+        self.uids = [] # UID of each record in its own file
+        self._lookup = dict((f, {}) for f in self.fields)
+        self._pending = dict((f, []) for f in self.fields) # Chunks of codes
+        self._pending_files = []
+        self._rows = dict((f, []) for f in self.fields) # Codes of single records
+        self._row_files = []
+        for f in self.fields:
+            self.codes[f] = np.empty(0, dtype=np.int32)
+            self.values[f] = []
+
+    def __len__(self):
+        return (len(self.filenum) + sum(len(x) for x in self._pending_files) +
+         len(self._row_files))
+
+    def _encode(self, f, value):
+        lookup = self._lookup[f]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self.values[f])
+            self.values[f].append(value)
+        return code
+
+    def append(self, row, filenum, uid):
+        '''
+        Adds a record given as a list of values in the order of fields.
+        '''
+        for f, value in zip(self.fields, row):
+            self._rows[f].append(self._encode(f, value))
+        self._row_files.append(filenum)
+        self.uids.append(uid)
+
+    def append_columns(self, columns, filenum, uids):
+        '''
+        Adds a chunk of records from the same file, given as one sequence of
+        values per field in the order of fields. Only the distinct values of
+        each field in the chunk are looked up.
+        '''
+        self._flush_rows()
+        for f, values in zip(self.fields, columns):
+            local, uniques = pd.factorize(np.asarray(values, dtype=object))
+            codes = np.array([self._encode(f, x) for x in uniques], dtype=np.int32)
+            self._pending[f].append(codes[local])
+        self._pending_files.append(np.full(len(uids), filenum, dtype=np.int32))
+        self.uids.extend(uids)
+
+    def _flush_rows(self):
+        if not self._row_files:
+            return
+        for f in self.fields:
+            self._pending[f].append(np.array(self._rows[f], dtype=np.int32))
+            self._rows[f] = []
+        self._pending_files.append(np.array(self._row_files, dtype=np.int32))
+        self._row_files = []
+
+    def finish(self):
+        '''
+        Moves appended records into the code arrays.
+        '''
+        self._flush_rows()
+        for f in self.fields:
+            self.codes[f] = np.concatenate([self.codes[f]] + self._pending[f])
+            self._pending[f] = []
+        self.filenum = np.concatenate([self.filenum] + self._pending_files)
+        self._pending_files = []
+
+    def sampler_fields(self, column_types):
+        '''
+        The fields in the column order of matrix: string fields first, then
+        categorical.
+        '''
+        return ([x for x in self.fields if column_types[x].upper() == 'S'] +
+         [x for x in self.fields if column_types[x].upper() == 'C'])
+
+    def matrix(self, column_types, rows=None):
+        '''
+        Returns the code matrix for the sampler (string fields first, then
+        categorical), the number of string fields and the distinct values of
+        each string field. If rows is given, only those records are included
+        and codes are renumbered to cover just their values.
+        '''
+        cols = self.sampler_fields(column_types)
+        ps = len([x for x in cols if column_types[x].upper() == 'S'])
+        X = np.empty((len(self.filenum) if rows is None else len(rows),
+         len(cols)), dtype=np.int64)
+        values = []
+        for l, col in enumerate(cols):
+            codes = self.codes[col] if rows is None else self.codes[col][rows]
+            used, X[:, l] = np.unique(codes, return_inverse=True)
+            if l < ps:
+                values.append([self.values[col][i] for i in used])
+        return X, ps, values
+
+    def filled(self):
+        '''
+        Number of non-empty linking fields of each record.
+        '''
+        rv = np.zeros(len(self.filenum), dtype=np.int64)
+        for f in self.fields:
+            empty = self._lookup[f].get('')
+            rv += self.codes[f] != (-1 if empty is None else empty)
+        return rv
+
+    def to_frame(self, rows=None):
+        '''
+        Decodes the records into a DataFrame of the fields plus ETL_ID.
+        '''
+        if rows is None:
+            rows = np.arange(len(self.filenum))
+        frame = pd.DataFrame(dict(
+         (f, np.asarray(self.values[f], dtype=object)[self.codes[f][rows]])
+         for f in self.fields), columns=self.fields)
+        frame['ETL_ID'] = np.asarray(rows) + 1
+        return frame
+
+    def save(self, filename):
+        '''
+        Saves the store as a .npz file.
+        '''
+        arrays = {'fields': np.array(self.fields, dtype=object),
+         'filenum': self.filenum, 'uids': np.array(self.uids, dtype=object)}
+        for i, f in enumerate(self.fields):
+            arrays['codes_{}'.format(i)] = self.codes[f]
+            arrays['values_{}'.format(i)] = np.array(self.values[f], dtype=object)
+        np.savez_compressed(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Loads a store saved with save.
+        '''
+        data = np.load(filename, allow_pickle=True)
+        rv = cls(list(data['fields']))
+        rv.filenum = data['filenum']
+        rv.uids = list(data['uids'])
+        for i, f in enumerate(rv.fields):
+            rv.codes[f] = data['codes_{}'.format(i)]
+            rv.values[f] = list(data['values_{}'.format(i)])
+            rv._lookup[f] = dict((v, c) for c, v in enumerate(rv.values[f]))
+        return rv
+
+
+def collapse(X, filenum):
+    '''
+    Groups the records of each file whose codes in X are all identical.
+    Returns the distinct rows, the file number and number of records of each
+    row, and the row of each record.
+    '''
+    keyed = np.column_stack([filenum, X])
+    distinct, inverse, counts = np.unique(keyed, axis=0, return_inverse=True,
+     return_counts=True)
+    return distinct[:, 1:], distinct[:, 0], counts, inverse
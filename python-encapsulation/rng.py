@@ -0,0 +1,35 @@
+# Reproducible random number streams for ebLink.
+#
+# A Streams object hands out a fresh generator for every counter, such as a
+# (step, iteration) pair of the Gibbs sampler, seeded by hashing the counter
+# together with the run's seed and keys like the chain and block. Each draw
+# therefore depends only on where it happens in the run, not on which process
+# ran it or what ran before it, so serial, parallel and resumed runs give
+# identical results.
+
+import hashlib
+import numpy as np
+
+
+class Streams(object):
+    '''
+    Independent random streams for seed and keys, one per counter.
+    '''
+
+    def __init__(self, seed, *keys):
+        self.seed = seed
+        self.keys = keys
+
+    def words(self, *counter):
+        '''
+        The 32 bit seed words of the stream for counter.
+        '''
+        key = '/'.join(str(x) for x in (self.seed,) + self.keys + counter)
+        digest = hashlib.sha256(key).digest()
+        return np.frombuffer(digest, dtype=np.uint32)
+
+    def get(self, *counter):
+        '''
+        A generator for the stream of counter.
+        '''
+        return np.random.RandomState(self.words(*counter))
@@ -0,0 +1,247 @@
+# On-disk store for the artifacts of an ebLink run.
+#
+# A run is saved as a directory:
+#    config.json       settings, blocking, estimates and diagnostics
+#    records/          codes_<i>.npy, values_<i>.npy per field, filenum.npy,
+#                      uids.npy and blocks.npy
+#    pairs.npy         linked pairs of ETL_IDs, one per row
+#    crosswalk/        cluster.npy, file.npy, UID.npy and ETL_ID.npy
+#    lambda/           <block>-<chain>.npy lambda draws
+#    states/           <block>.npz final sampler state (numpy backend)
+# Every array is a plain .npy file, so it can be memory-mapped, and RunStore
+# only reads the parts a caller asks for.
+
+import json
+import os
+import shutil
+from collections import MutableMapping
+import numpy as np
+import pandas as pd
+from records import RecordStore
+from lambda_store import LambdaHistory
+
+FORMAT_VERSION = 1
+CROSSWALK_COLUMNS = ['cluster', 'file', 'UID', 'ETL_ID']
+
+def _plain(values):
+    '''
+    values as an array that can be memory-mapped: numbers stay numbers and
+    anything else becomes fixed width strings.
+    '''
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = values.astype(str)
+    return values
+
+def _native(x):
+    '''
+    x read from JSON with its unicode strings made str again, as they were
+    saved.
+    '''
+    if isinstance(x, dict):
+        return dict((_native(k), _native(v)) for k, v in x.items())
+    if isinstance(x, list):
+        return [_native(v) for v in x]
+    if isinstance(x, unicode):
+        return x.encode('utf-8')
+    return x
+
+def _jsonable(x):
+    if isinstance(x, dict):
+        return dict((str(k), _jsonable(v)) for k, v in x.items())
+    if isinstance(x, (list, tuple)):
+        return [_jsonable(v) for v in x]
+    if isinstance(x, np.generic):
+        return x.item()
+    return x
+
+def save_run(link, path):
+    '''
+    Saves the inputs and outputs of an EBlink to the directory path.
+    '''
+    for d in ['records', 'crosswalk', 'lambda', 'states']:
+        if not os.path.isdir(os.path.join(path, d)):
+            os.makedirs(os.path.join(path, d))
+    blocking = link._blocking
+    config = {'version': FORMAT_VERSION,
+     'files': [f if isinstance(f, basestring) else None for f in link._files],
+     'columns': link._columns, 'match_columns': link._matchcolumns,
+     'indices': link._indices, 'column_types': link._column_types,
+     'alpha': link.alpha, 'beta': link.beta, 'iterations': link.iterations,
+     'burn_in': link.burn_in, 'thin': link.thin,
+     'distance_cutoff': link.distance_cutoff, 'distance_cache': link.distance_cache,
+     'chunk_rows': link.chunk_rows, 'checkpoint_every': link.checkpoint_every,
+     'collapse_duplicates': link.collapse_duplicates,
+     'blocking': blocking and {'exact': blocking.exact,
+      'phonetic': blocking.phonetic, 'prefix': blocking.prefix},
+     'block_ids': [[list(k), v] for k, v in link._block_ids.items()],
+     'numrecords': link._numrecords, 'num_linked': link._num_linked,
+     'pop_est': link.pop_est, 'chain_pop_est': link.chain_pop_est,
+     'between_chain_var': link.between_chain_var, 'convergence': link.convergence,
+     'results': [[b, link._results[b][0], len(link._results[b][1])]
+      for b in sorted(link._results)],
+     'lambda': {}}
+
+    store = link._records
+    if store is not None:
+        for i, f in enumerate(store.fields):
+            np.save(os.path.join(path, 'records', 'codes_{}.npy'.format(i)), store.codes[f])
+            np.save(os.path.join(path, 'records', 'values_{}.npy'.format(i)),
+             _plain(store.values[f]))
+        np.save(os.path.join(path, 'records', 'filenum.npy'), store.filenum)
+        np.save(os.path.join(path, 'records', 'uids.npy'), _plain(store.uids))
+        config['fields'] = store.fields
+    if link._blocks is not None:
+        np.save(os.path.join(path, 'records', 'blocks.npy'), link._blocks)
+
+    pairs = np.array(link.pairs or [], dtype=np.int64).reshape(-1, 2)
+    np.save(os.path.join(path, 'pairs.npy'), pairs)
+    if link.crosswalk is not None:
+        for col in CROSSWALK_COLUMNS:
+            np.save(os.path.join(path, 'crosswalk', '{}.npy'.format(col)),
+             _plain(link.crosswalk[col].values))
+
+    for b, parts in link._lambda_files.items():
+        config['lambda'][str(b)] = []
+        for chain, part in enumerate(parts):
+            filename = '{}-{}.npy'.format(b, chain)
+            target = os.path.join(path, 'lambda', filename)
+            if isinstance(part, tuple):
+                # Only the first rows hold draws if the run stopped early
+                source = np.load(part[0], mmap_mode='r')
+                if part[1] == len(source):
+                    shutil.copyfile(part[0], target)
+                else:
+                    np.save(target, source[:part[1]])
+            elif isinstance(part, basestring):
+                shutil.copyfile(part, target)
+            else:
+                np.save(target, np.asarray(part))
+            config['lambda'][str(b)].append(filename)
+    for b, state in link._states.items():
+        np.savez(os.path.join(path, 'states', '{}.npz'.format(b)), **state)
+
+    with open(os.path.join(path, 'config.json'), 'w') as f:
+        json.dump(_jsonable(config), f, indent=1, sort_keys=True)
+
+
+class RunStore(object):
+    '''
+    A run saved with save_run. Each part is read the first time it is used,
+    with arrays memory-mapped.
+    '''
+
+    def __init__(self, path):
+        if not os.path.isfile(os.path.join(path, 'config.json')):
+            raise IOError('{} is not a saved run.'.format(path))
+        self.path = path
+        self._cache = {}
+
+    def _load(self, *parts):
+        return np.load(os.path.join(self.path, *parts), mmap_mode='r')
+
+    def _cached(self, name, load):
+        if name not in self._cache:
+            self._cache[name] = load()
+        return self._cache[name]
+
+    @property
+    def config(self):
+        def load():
+            with open(os.path.join(self.path, 'config.json'), 'r') as f:
+                return _native(json.load(f))
+        return self._cached('config', load)
+
+    @property
+    def records(self):
+        '''
+        The RecordStore of the run, with memory-mapped codes.
+        '''
+        def load():
+            store = RecordStore([str(x) for x in self.config['fields']])
+            for i, f in enumerate(store.fields):
+                store.codes[f] = self._load('records', 'codes_{}.npy'.format(i))
+                store.values[f] = list(self._load('records', 'values_{}.npy'.format(i)))
+                store._lookup[f] = dict((v, c) for c, v in enumerate(store.values[f]))
+            store.filenum = self._load('records', 'filenum.npy')
+            store.uids = list(self._load('records', 'uids.npy'))
+            return store
+        return self._cached('records', load)
+
+    @property
+    def blocks(self):
+        if not os.path.exists(os.path.join(self.path, 'records', 'blocks.npy')):
+            return None
+        return self._cached('blocks', lambda: self._load('records', 'blocks.npy'))
+
+    @property
+    def pairs(self):
+        return self._cached('pairs', lambda: self._load('pairs.npy'))
+
+    @property
+    def crosswalk(self):
+        if not os.path.exists(os.path.join(self.path, 'crosswalk', 'cluster.npy')):
+            return None
+        return self._cached('crosswalk', lambda: pd.DataFrame(dict(
+         (col, self._load('crosswalk', '{}.npy'.format(col)))
+         for col in CROSSWALK_COLUMNS), columns=CROSSWALK_COLUMNS))
+
+    def lambda_history(self, block=0):
+        '''
+        The lambda draws of every chain of a block, memory-mapped.
+        '''
+        return LambdaHistory([os.path.join(self.path, 'lambda', x)
+         for x in self.config['lambda'][str(block)]])
+
+    def state(self, block=0):
+        '''
+        The final sampler state of a block, or None if there is none.
+        '''
+        filename = os.path.join(self.path, 'states', '{}.npz'.format(block))
+        if not os.path.exists(filename):
+            return None
+        return dict(np.load(filename))
+
+    def state_blocks(self):
+        '''
+        The blocks with a saved sampler state, without reading them.
+        '''
+        directory = os.path.join(self.path, 'states')
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(x[:-len('.npz')]) for x in os.listdir(directory)
+         if x.endswith('.npz'))
+
+
+class LazyStates(MutableMapping):
+    '''
+    The final sampler state of each block of a RunStore, as a dict that
+    reads each state the first time it is used. States set afterwards, as
+    by model_incremental, replace the saved ones.
+    '''
+
+    def __init__(self, run):
+        self._run = run
+        self._blocks = set(run.state_blocks())
+        self._loaded = {}
+
+    def __getitem__(self, block):
+        if block not in self._blocks:
+            raise KeyError(block)
+        if block not in self._loaded:
+            self._loaded[block] = self._run.state(block)
+        return self._loaded[block]
+
+    def __setitem__(self, block, state):
+        self._blocks.add(block)
+        self._loaded[block] = state
+
+    def __delitem__(self, block):
+        self._blocks.remove(block)
+        self._loaded.pop(block, None)
+
+    def __iter__(self):
+        return iter(sorted(self._blocks))
+
+    def __len__(self):
+        return len(self._blocks)
@@ -0,0 +1,138 @@
+# Long-lived workers for running ebLink samplers.
+#
+# Starting a backend is slow: R has to be readied and the ebLink scripts
+# sourced, and numpy workers import scipy and the sampler. When many small
+# jobs are run, such as the blocks of a finely blocked linkage, that startup
+# can take longer than the sampling. A worker loads its backends once and then
+# serves units of work (see parallel.run_unit) sent over a local socket, so
+# startup is paid once per worker rather than once per job.
+#
+# Usage:
+#    python worker.py 6000 --authkey secret --backend numpy
+#    link.set_workers([('localhost', 6000)], 'secret')
+#
+# Units are pickled, so only connect to workers you started yourself; the
+# authkey keeps other local users out. Paths in units are absolute, so a
+# worker can run from any directory.
+
+import argparse
+import threading
+import traceback
+from multiprocessing import Process
+from multiprocessing.connection import Client, Listener
+from Queue import Empty, Queue
+from parallel import run_unit
+
+def load(backends):
+    '''
+    Imports each backend and readies it, so later units start straight away.
+    '''
+    for backend in backends:
+        if backend == 'numpy':
+            import numpy_interface
+        else:
+            import R_interface
+            R_interface.load()
+
+def serve(address, authkey, backends=('numpy',)):
+    '''
+    Loads backends and then runs units sent to address until told to stop.
+    Each message is a unit, answered with ('ok', result) or ('error',
+    traceback), or None to stop the worker.
+    '''
+    load(backends)
+    listener = Listener(address, authkey=authkey)
+    try:
+        while True:
+            conn = listener.accept()
+            try:
+                while True:
+                    try:
+                        unit = conn.recv()
+                    except EOFError:
+                        break
+                    if unit is None:
+                        return
+                    try:
+                        conn.send(('ok', run_unit(unit)))
+                    except Exception:
+                        conn.send(('error', traceback.format_exc()))
+            finally:
+                conn.close()
+    finally:
+        listener.close()
+
+def start(address, authkey, backends=('numpy',)):
+    '''
+    Starts a worker serving address in a background process and returns the
+    process.
+    '''
+    process = Process(target=serve, args=(address, authkey, backends))
+    process.daemon = True
+    process.start()
+    return process
+
+def stop(address, authkey):
+    '''
+    Tells the worker at address to stop.
+    '''
+    conn = Client(address, authkey=authkey)
+    conn.send(None)
+    conn.close()
+
+def run_remote(units, addresses, authkey):
+    '''
+    Runs units on the workers at addresses, each worker taking the next unit
+    as soon as it finishes one. Returns the results in the same order as
+    units, and raises RuntimeError if a unit failed.
+    '''
+    todo = Queue()
+    for i, unit in enumerate(units):
+        todo.put((i, unit))
+    results = [None] * len(units)
+    errors = []
+
+    def feed(address):
+        try:
+            conn = Client(address, authkey=authkey)
+        except Exception:
+            errors.append(traceback.format_exc())
+            return
+        try:
+            while not errors:
+                try:
+                    i, unit = todo.get_nowait()
+                except Empty:
+                    return
+                conn.send(unit)
+                status, result = conn.recv()
+                if status == 'error':
+                    errors.append(result)
+                    return
+                results[i] = result
+        except Exception:
+            errors.append(traceback.format_exc())
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=feed, args=(address,)) for address in addresses]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError('A worker failed:\n' + errors[0])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs an ebLink worker.')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--authkey', required=True)
+    parser.add_argument('--backend', action='append', choices=['numpy', 'R'],
+     help='backends to load up front (default numpy)')
+    args = parser.parse_args()
+    serve((args.host, args.port), args.authkey, args.backend or ['numpy'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+# Test code for blocking
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import blocking as bl
+
+def test_soundex():
+    assert bl.soundex('ROBERT') == 'R163'
+    assert bl.soundex('Rupert') == 'R163'
+    assert bl.soundex('TYMCZAK') == 'T522'
+    assert bl.soundex('ASHCRAFT') == 'A261'
+    assert bl.soundex('') == ''
+
+def test_blocks():
+    blocking = bl.Blocking(exact=['by'], phonetic=['lname'], prefix={'fname': 1})
+    records = [{'by': '1950', 'lname': 'MEIER', 'fname': 'KLAUS'},
+               {'by': '1950', 'lname': 'MAIER', 'fname': 'KARL'},
+               {'by': '1951', 'lname': 'MEIER', 'fname': 'KLAUS'},
+               {'by': '1950', 'lname': 'MEYER', 'fname': 'ANNA'}]
+    blocks = bl.assign_blocks([blocking.key(r) for r in records])
+    assert list(blocks) == [0, 0, 1, 2]
+    members = bl.block_members(blocks)
+    assert [list(m) for m in members] == [[0, 1], [2], [3]]
@@ -0,0 +1,23 @@
+# Test code for crosswalk construction
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import crosswalk as cw
+
+def test_find_clusters():
+    # 1-5-3 are only linked transitively
+    clusters = cw.find_clusters(7, [(5, 3), (1, 5), (6, 7), (7, 2)])
+    assert list(clusters) == [0, 1, 0, 2, 0, 1, 1]
+    assert list(cw.find_clusters(3, [])) == [0, 1, 2]
+
+def test_crosswalk_frame():
+    frame = cw.crosswalk_frame(np.array([0, 1, 0]), [1, 1, 2], ['a', 'b', 'c'])
+    assert list(frame.columns) == ['cluster', 'file', 'UID', 'ETL_ID']
+    assert list(frame[frame.cluster == 0].UID) == ['a', 'c']
+    assert list(frame.ETL_ID) == [1, 2, 3]
+
+def test_representatives():
+    clusters = np.array([0, 1, 0, 2, 0, 1])
+    assert list(cw.representatives(clusters, np.zeros(6))) == [0, 1, 3]
+    assert list(cw.representatives(clusters, [1, 0, 3, 0, 3, 2])) == [2, 3, 5]
@@ -0,0 +1,38 @@
+# Test code for the convergence diagnostics
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import diagnostics as dg
+
+def ar1(rng, n, phi, shift=0):
+    x = np.empty(n)
+    x[0] = 0
+    noise = rng.normal(size=n)
+    for i in range(1, n):
+        x[i] = phi * x[i - 1] + noise[i]
+    return x + shift
+
+def test_ess():
+    rng = np.random.RandomState(0)
+    assert 800 < dg.ess(rng.normal(size=1000)) < 1200
+    # AR(1) with phi 0.9 has an ESS near n * 0.1 / 1.9
+    assert 20 < dg.ess(ar1(rng, 1000, 0.9)) < 110
+    assert dg.ess(np.ones(50)) == 50
+
+def test_rhat_and_geweke():
+    rng = np.random.RandomState(1)
+    chains = [ar1(rng, 2000, 0.5) for _ in range(3)]
+    assert dg.split_rhat(chains) < 1.02
+    assert dg.split_rhat(chains[:2] + [chains[2] + 5]) > 1.5
+    assert abs(dg.geweke(chains[0])) < 3
+    assert abs(dg.geweke(np.linspace(0, 10, 1000) + rng.normal(size=1000))) > 5
+
+def test_stopping_rule():
+    rng = np.random.RandomState(2)
+    rule = dg.StoppingRule(min_ess=100, min_draws=50)
+    assert rule.converged([rng.normal(size=30)]) == (False, 'fewer than 50 draws')
+    converged, reason = rule.converged([rng.normal(size=500), rng.normal(size=500)])
+    assert converged
+    assert reason.startswith('ESS ')
+    assert not rule.converged([np.linspace(0, 10, 500)])[0]
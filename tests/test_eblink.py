@@ -2,6 +2,7 @@
 
 import sys
 sys.path.append('../python-encapsulation')
+import numpy as np
 import eblink as eb
 
 def test1():
@@ -19,6 +20,46 @@ def test1():
     link.model()
     link.build_crosswalk()
     
+def make_numpy_link(num_files=3):
+    link = eb.EBlink()
+    link.files = ['../test_data/RLData500_1.csv', '../test_data/RLData500_2.csv', '../test_data/RLData500_3.csv'][:num_files]
+    link.columns = [['fname_c1','lname_c1', 'by', 'bm', 'bd']] * num_files
+    link.match_columns = {'fname_c1':['fname_c1','fname_c1'], 'lname_c1':['lname_c1','lname_c1'], 'by':['by','by'], 'bm':['bm', 'bm'], 'bd':['bd', 'bd']}
+    link.indices = ['UID', 'UID', 'UID']
+    link.column_types = {'fname_c1':'s', 'lname_c1':'s', 'by':'c', 'bm':'c', 'bd':'c'}
+    link.iterations = 20
+    link.alpha = 10
+    link.beta = 50
+    link.build()
+    return link
+
+def test_seeded_chains():
+    estimates = []
+    pairs = []
+    for workers, seed in [(1, 3), (2, np.int64(3))]:
+        link = make_numpy_link()
+        link.model(backend='numpy', workers=workers, chains=2, seeds=seed)
+        link.clean_tmp()
+        estimates.append(link.chain_pop_est)
+        pairs.append(link.pairs)
+    # Seeded runs repeat in serial and in parallel, however the seed is typed,
+    # while chains differ
+    assert estimates[0] == estimates[1]
+    assert pairs[0] == pairs[1]
+    assert len(estimates[0]) == 2 and estimates[0][0] != estimates[0][1]
+    assert link.between_chain_var == np.var(estimates[0], ddof=1)
+    assert link.convergence[0]['chain_pop_est'] == estimates[0]
+
+def test_stopped_iterations():
+    link = make_numpy_link()
+    link.iterations, link.burn_in, link.thin = 200, 5, 3
+    link.set_stopping(min_ess=1, max_geweke=np.inf, max_rhat=np.inf,
+     check_every=7, min_draws=5)
+    link.model(backend='numpy', seeds=1)
+    link.clean_tmp()
+    # The first check with 5 kept draws is after 21 iterations
+    assert link.convergence[0]['iterations'] == [21]
+    assert link.convergence[0]['stopped_early']
 
 if __name__ == '__main__':
     test1()
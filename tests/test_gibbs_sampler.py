@@ -0,0 +1,198 @@
+# Test code for the numpy gibbs sampler
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import pandas as pd
+import distance as ds
+import gibbs_sampler as gs
+import latent_index as li
+import records as rc
+from diagnostics import StoppingRule
+from rng import Streams
+
+def load_rldata500():
+    files = ['../test_data/RLData500_1.csv', '../test_data/RLData500_2.csv', '../test_data/RLData500_3.csv']
+    data = pd.concat([pd.read_csv(f, dtype=str, keep_default_na=False) for f in files])
+    filenum = np.repeat([1, 2, 3], [len(pd.read_csv(f)) for f in files])
+    X = np.empty((len(data), 5), dtype=np.int64)
+    values = []
+    for l, col in enumerate(['fname_c1', 'lname_c1', 'by', 'bm', 'bd']):
+        codes, uniques = pd.factorize(data[col], sort=True)
+        X[:, l] = codes
+        if l < 2:
+            values.append(list(uniques))
+    return X, filenum, values
+
+def test_edit_distances():
+    d = ds.edit_distances(['KITTEN', 'SITTING', '', 'KITTEN'])
+    assert d[0, 1] == 3
+    assert d[1, 0] == 3
+    assert d[0, 2] == 6
+    assert d[0, 3] == 0
+    assert (np.diag(d) == 0).all()
+
+def test_sampler():
+    X, filenum, values = load_rldata500()
+    sampler = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=1)
+    lam, est = sampler.run(50)
+    assert lam.shape == (50, len(X))
+    assert lam.min() >= 1 and lam.max() <= len(X)
+    # Undistorted fields always agree with the linked latent
+    undistorted = sampler.z == 0
+    assert (sampler.X[undistorted] == sampler.Y[sampler.lam][undistorted]).all()
+    # 449 true entities in RLData500
+    assert 400 < est[-10:].mean() < len(X)
+
+def test_resume_with_new_records():
+    X, filenum, values = load_rldata500()
+    old = filenum < 3
+    sampler = gs.GibbsSampler(X[old], filenum[old], 2, 10, 50, values=values, seed=1)
+    sampler.run(20)
+    state = sampler.get_state()
+    sampler = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=2)
+    sampler.set_state(state)
+    sampler.active = ~old
+    lam, est = sampler.run(10)
+    # Existing records keep their links; new ones start on latents of their own
+    assert (np.asarray(lam)[:, old] == state['lam'] + 1).all()
+    assert sampler.lam.max() < len(X)
+    undistorted = sampler.z == 0
+    assert (sampler.X[undistorted] == sampler.Y[sampler.lam][undistorted]).all()
+
+def test_checkpoint_resume(tmpdir):
+    X, filenum, values = load_rldata500()
+    out, checkpoint = str(tmpdir.join('lam.npy')), str(tmpdir.join('checkpoint.npz'))
+    sampler = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=1)
+    lam, est = sampler.run(20, burn_in=2, thin=3)
+    # Interrupt a run after 15 iterations, with a checkpoint at 10
+    sampler = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=1)
+    iterate = sampler.iterate
+    def interrupted(g):
+        if len(interrupted.calls) == 15:
+            raise KeyboardInterrupt
+        interrupted.calls.append(1)
+        iterate(g)
+    interrupted.calls = []
+    sampler.iterate = interrupted
+    try:
+        sampler.run(20, out, 2, 3, checkpoint=checkpoint, checkpoint_every=10)
+    except KeyboardInterrupt:
+        pass
+    sampler = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=7)
+    resumed, resumed_est = sampler.run(20, out, 2, 3, checkpoint=checkpoint,
+     checkpoint_every=10, resume=True)
+    assert (np.asarray(resumed) == lam).all()
+    assert (resumed_est == est).all()
+
+def test_early_stopping():
+    X, filenum, values = load_rldata500()
+    sampler = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=1)
+    rule = StoppingRule(min_ess=1, max_geweke=np.inf, max_rhat=np.inf,
+     check_every=20, min_draws=10)
+    lam, est = sampler.run(200, burn_in=5, stopping=rule)
+    assert sampler.stopped[0] == 20
+    assert len(lam) == len(est) == 15
+
+def test_scatter():
+    X, filenum, values = load_rldata500()
+    sampler = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=1)
+    sampler.scatter()
+    assert (sampler.lam != np.arange(len(X))).any()
+    # Fields that disagree with the latent start out distorted
+    assert (sampler.z == (sampler.X != sampler.Y[sampler.lam])).all()
+    lam, est = sampler.run(5)
+    assert lam.max() <= len(X)
+
+def test_empty_latents():
+    X, filenum, values = load_rldata500()
+    sampler = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=1,
+     M=2 * len(X))
+    lam, est = sampler.run(20)
+    empty = sampler.members.counts == 0
+    assert empty.sum() >= len(X)
+    # Empty latents are indexed under a value no record holds
+    assert (sampler.index.Y[empty] == [len(x) for x in sampler.alpha]).all()
+    assert (sampler.index.Y[~empty] == sampler.Y[~empty]).all()
+    undistorted = sampler.z == 0
+    assert (sampler.X[undistorted] == sampler.Y[sampler.lam][undistorted]).all()
+
+def test_weighted_rows():
+    X, filenum, values = load_rldata500()
+    # The first 100 records each appear three times
+    rows, files, weights, expand = rc.collapse(
+     np.concatenate([X, X[:100], X[:100]]), np.concatenate([filenum] + [filenum[:100]] * 2))
+    sampler = gs.GibbsSampler(rows, files, 2, 10, 50, values=values, seed=1,
+     M=len(expand), weights=weights, expand=expand)
+    lam, est = sampler.run(20)
+    assert lam.shape == (20, len(X) + 200)
+    assert (lam[:, :100] == lam[:, len(X):len(X) + 100]).all()
+    assert 350 < est[-5:].mean() <= len(rows)
+
+def test_collapsed_priors():
+    # Collapsing duplicates leaves the priors of the records unchanged
+    X = np.array([[0, 0], [0, 0], [0, 0], [1, 1], [2, 0]])
+    filenum = np.array([1, 1, 2, 2, 2])
+    values = [['ANNA', 'ANNE', 'BOB']]
+    full = gs.GibbsSampler(X, filenum, 1, 10, 50, values=values, seed=1)
+    rows, files, weights, expand = rc.collapse(X, filenum)
+    collapsed = gs.GibbsSampler(rows, files, 1, 10, 50, values=values, seed=1,
+     M=len(expand), weights=weights, expand=expand)
+    assert np.allclose(full.alpha[0], [.6, .2, .2])
+    for l in range(2):
+        assert np.allclose(full.alpha[l], collapsed.alpha[l])
+    assert np.allclose(full.h[0], collapsed.h[0])
+
+def test_streams():
+    X, filenum, values = load_rldata500()
+    runs = []
+    for seed in [5, 5, 6]:
+        sampler = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values,
+         streams=Streams(seed, 0, 1))
+        runs.append(sampler.run(10)[0])
+    assert (runs[0] == runs[1]).all()
+    assert (runs[0] != runs[2]).any()
+    # A stream depends only on its seed, keys and counter
+    assert (Streams(5, 0, 1).get('draw_z', 3).random_sample(4) ==
+     Streams(5, 0, 1).get('draw_z', 3L).random_sample(4)).all()
+    assert (Streams(5, 0, 1).words('draw_z', 3) != Streams(5, 1, 0).words('draw_z', 3)).any()
+
+def test_inverted_index_update():
+    rng = np.random.RandomState(0)
+    Y = rng.randint(0, 6, size=(40, 2))
+    index = li.InvertedIndex(Y, [6, 6])
+    Y[rng.randint(0, 40, size=5), 1] = rng.randint(0, 6, size=5)
+    index.update(Y)
+    for v in range(6):
+        assert sorted(index.postings(1, v)) == list(np.flatnonzero(Y[:, 1] == v))
+    X = Y[:3]
+    z = np.array([[0, 0], [1, 0], [1, 1]])
+    rows, latents = index.candidates(X, z)
+    for r in range(3):
+        expected = [j for j in range(40) if all(z[r, l] or Y[j, l] == X[r, l] for l in range(2))]
+        assert sorted(latents[rows == r]) == expected
+
+def test_latent_members_update():
+    rng = np.random.RandomState(0)
+    lam = rng.randint(0, 10, size=100)
+    members = li.LatentMembers(lam, 12)
+    for moves in [5, 60]:
+        lam = lam.copy()
+        lam[rng.randint(0, 100, size=moves)] = rng.randint(0, 12, size=moves)
+        members.update(lam)
+        for j in range(12):
+            assert list(members.members(j)) == list(np.flatnonzero(lam == j))
+        assert (members.latent_of == np.sort(lam)).all()
+
+def test_distance_kernel(tmpdir):
+    values = ['MEIER', 'MAIER', 'MEYER', 'MULLER', 'SCHMIDT']
+    first, second, distance = ds.close_pairs(values, 1)
+    assert sorted(zip(first, second, distance)) == [(0, 1, 1), (0, 2, 1)]
+    kernel = ds.DistanceKernel.build(values, cutoff=2, cache_dir=str(tmpdir))
+    dense = np.exp(-ds.edit_distances(values).astype(float))
+    expected = np.where(ds.edit_distances(values) <= 2, dense, 0)
+    assert np.allclose(kernel.matrix.toarray(), expected)
+    assert np.allclose(kernel.lookup([0, 0, 3], [2, 4, 3]), expected[[0, 0, 3], [2, 4, 3]])
+    assert len(tmpdir.listdir()) == 1
+    cached = ds.DistanceKernel.build(values, cutoff=2, cache_dir=str(tmpdir))
+    assert np.allclose(cached.matrix.toarray(), expected)
@@ -0,0 +1,24 @@
+# Test code for lambda storage
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import lambda_store as ls
+
+def test_writer(tmpdir):
+    path = str(tmpdir.join('lambda.npy'))
+    writer = ls.LambdaWriter(path, 3, 10, burn_in=4, thin=2)
+    for g in range(10):
+        writer.add(g, [g, g, g])
+    lam = writer.close()
+    assert isinstance(lam, np.memmap)
+    assert lam.dtype == np.int32
+    assert list(lam[:, 0]) == [4, 6, 8]
+
+def test_history(tmpdir):
+    path = str(tmpdir.join('lambda.npy'))
+    np.save(path, np.arange(12, dtype=np.int32).reshape(4, 3))
+    history = ls.LambdaHistory([path, np.zeros((2, 3), dtype=np.int32)])
+    assert history.shape == (6, 3)
+    assert [len(x) for x in history.chunks(3)] == [3, 1, 2]
+    assert np.asarray(history).sum() == 66
@@ -0,0 +1,21 @@
+# Test code for parallel execution of ebLink runs
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import pandas as pd
+import parallel as pl
+
+def test_run_units(tmpdir):
+    tmp = str(tmpdir.join('records.csv'))
+    data = pd.read_csv('../test_data/RLData500_1.csv').head(40)
+    data[['fname_c1', 'lname_c1', 'by']].to_csv(tmp, index=False)
+    types = {'fname_c1': 's', 'lname_c1': 's', 'by': 'c'}
+    unit = ('numpy', (tmp, str(tmpdir), types, 1, 99, 5, [1] * 20 + [2] * 20, 40), {})
+    results = pl.run_units([unit] * 3, workers=2)
+    assert len(results) == 3
+    assert [x[2] for x in results] == [5] * 3
+    lam, est_pop = pl.merge_chains(results)
+    assert lam.shape == (15, 40)
+    assert est_pop.shape == (15,)
+    assert (est_pop <= 40).all()
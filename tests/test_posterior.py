@@ -0,0 +1,37 @@
+# Test code for posterior summaries of lambda draws
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import lambda_store as ls
+import posterior as ps
+
+def naive_links(lam_gs):
+    # Direct translation of mpmms and links in analyzeGibbs.R
+    G, N = lam_gs.shape
+    rv = []
+    for r in range(N):
+        counts = {}
+        order = []
+        for g in range(G):
+            mms = tuple(np.flatnonzero(lam_gs[g] == lam_gs[g, r]) + 1)
+            if mms not in counts:
+                counts[mms] = 0
+                order.append(mms)
+            counts[mms] += 1
+        best = max(order, key=lambda x: (counts[x], -order.index(x)))
+        if len(best) > 1 and counts[best] / float(G) > 0.5 and r + 1 == min(best):
+            rv.append(list(best))
+    return rv
+
+def test_links():
+    rng = np.random.RandomState(3)
+    lam_gs = rng.randint(1, 9, size=(40, 12))
+    # Records 1, 4 and 7 share a latent most of the time
+    lam_gs[:30, [0, 3, 6]] = 20
+    lam_gs[:25, [1, 2]] = 21
+    expected = naive_links(lam_gs)
+    assert [list(x) for x in ps.links(lam_gs)] == expected
+    history = ls.LambdaHistory([lam_gs[:15], lam_gs[15:]])
+    assert [list(x) for x in ps.links(history)] == expected
+    assert ps.pairwise(ps.links(lam_gs)) == [(1, 4), (1, 7), (4, 7), (2, 3)]
@@ -0,0 +1,47 @@
+# Test code for shared prior tables
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import distance as ds
+import gibbs_sampler as gs
+import priors as pr
+from test_gibbs_sampler import load_rldata500
+
+def test_align():
+    values = ['ANNA', 'ANNE', 'BOB']
+    table = pr.PriorTable.build('fname', values, np.array([0, 0, 1, 2]), string=True)
+    assert list(table.alpha) == [.5, .25, .25]
+    kernel = ds.DistanceKernel.build(values)
+    assert np.allclose(table.h, kernel.normalizers(table.alpha))
+    alpha, h = table.align(['BOB', 'ANNI'])
+    assert list(alpha) == [.25, .25]
+    assert h[0] == table.h[2]
+    # An unseen value is scored against the reference values
+    d = ds.edit_distances(values + ['ANNI'])[3]
+    assert np.isclose(h[1], 1 / (np.exp(-d[:3]).dot(table.alpha) + .25))
+    alpha, h = pr.PriorTable('by', ['1950'], [4]).align(['1950'])
+    assert list(alpha) == [1] and h is None
+
+def test_save_and_load(tmpdir):
+    table = pr.PriorTable.build('fname', ['ANNA', 'BOB'], np.array([0, 1, 1]),
+     string=True, cutoff=2)
+    pr.save_priors({'fname': table}, str(tmpdir))
+    loaded = pr.load_priors(str(tmpdir))['fname']
+    assert loaded.key == table.key
+    assert loaded.cutoff == 2
+    assert list(loaded.counts) == [1, 2]
+    assert np.allclose(loaded.h, table.h)
+
+def test_sampler_priors():
+    # Tables of the records themselves give the same chain as none
+    X, filenum, values = load_rldata500()
+    priors = []
+    for l in range(X.shape[1]):
+        table = pr.PriorTable.build(l, values[l] if l < 2 else range(X[:, l].max() + 1),
+         X[:, l], string=l < 2)
+        priors.append(table.align(table.values))
+    est = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=1).run(10)[1]
+    shared = gs.GibbsSampler(X, filenum, 2, 10, 50, values=values, seed=1,
+     priors=priors).run(10)[1]
+    assert np.allclose(est, shared)
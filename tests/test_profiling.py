@@ -0,0 +1,36 @@
+# Test code for the profiling instrumentation
+
+import sys
+sys.path.append('../python-encapsulation')
+import pickle
+import profiling as pf
+
+def test_profiler(tmpdir):
+    log = str(tmpdir.join('profile.jsonl'))
+    seen = []
+    profiler = pf.Profiler(log, seen.append)
+    for i in range(3):
+        with profiler.stage('draw_lambda') as record:
+            record['candidates'] = 10
+    with pf.stage(profiler, 'build', records=5):
+        pass
+    with pf.stage(None, 'build', records=5) as record:
+        record['ignored'] = True
+    assert profiler.metrics['draw_lambda']['calls'] == 3
+    assert profiler.metrics['draw_lambda']['candidates'] == 30
+    assert profiler.metrics['build']['records'] == 5
+    assert profiler.metrics['build']['max_rss_mb'] > 0
+    assert len(seen) == 4
+    # The log stays open and is flushed as each stage ends
+    log_file = profiler._file
+    with profiler.stage('build'):
+        pass
+    assert profiler._file is log_file
+    assert len(open(log).readlines()) == 5
+    # Logs from other processes are merged in with tags
+    merged = pf.Profiler()
+    merged.read_log(log, block=2)
+    assert merged.metrics['draw_lambda'] == profiler.metrics['draw_lambda']
+    restored = pickle.loads(pickle.dumps(profiler))
+    assert restored.callback is None and restored._file is None
+    profiler.close()
@@ -0,0 +1,33 @@
+# Test code for matching single records
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import query as qr
+from test_eblink import make_numpy_link
+
+def test_modes():
+    clusters = np.array([0, 0, 0, 1, 2, 2])
+    codes = np.array([3, 1, 3, 2, 4, 0])
+    assert list(qr._modes(clusters, codes, 3)) == [3, 2, 0]
+
+def test_query():
+    link = make_numpy_link()
+    link.model(backend='numpy', seeds=1)
+    link.clean_tmp()
+    link.build_crosswalk()
+    index = qr.MatchIndex.from_eblink(link)
+    records = link._records.to_frame().to_dict('records')
+    record = records[0]
+    cluster = link.crosswalk.cluster[0]
+    matches = index.query(record)
+    assert matches[0][0] == cluster
+    assert np.isclose(sum(p for c, p in matches), 1)
+    # A typo lowers but keeps the match
+    typo = dict(record, fname_c1=record['fname_c1'] + 'X')
+    assert index.query(typo)[0][0] == cluster
+    assert index.query(typo)[0][1] < matches[0][1]
+    # A record far from every entity is new
+    stranger = dict(record, fname_c1='ZZZQ', lname_c1='QQQZ', by='1800')
+    assert index.query(stranger) == [(qr.NEW_ENTITY, 1.0)]
+    assert len(index.query_many(records[:3])) == 3
@@ -0,0 +1,64 @@
+# Test code for the chunked readers
+
+import sys
+sys.path.append('../python-encapsulation')
+import csv
+import gzip
+import pandas as pd
+import readers as rd
+import records as rc
+from blocking import Blocking
+
+def test_compressed_csv(tmpdir):
+    filename = str(tmpdir.join('RLData500_1.csv.gz'))
+    with open('../test_data/RLData500_1.csv', 'rb') as src:
+        f = gzip.open(filename, 'wb')
+        f.write(src.read())
+        f.close()
+    chunks = list(rd.read_chunks(filename, ['lname_c1', 'UID'], chunk_rows=60))
+    assert [len(x) for x in chunks] == [60, 60, 60, 20]
+    assert list(chunks[0].columns) == ['lname_c1', 'UID']
+    assert chunks[0].UID[0] == '2'
+    assert chunks[0].lname_c1[0] == 'BAUER'
+
+def test_frame_and_fallback():
+    frame = pd.DataFrame({'by': [1950, 1951, 1952], 'name': ['A', None, 'C']})
+    chunks = list(rd.read_chunks(frame, ['name', 'by'], chunk_rows=2))
+    assert [len(x) for x in chunks] == [2, 1]
+    assert list(pd.concat(chunks).by) == ['1950', '1951', '1952']
+    assert list(pd.concat(chunks).name) == ['A', '', 'C']
+    rows = [['name', 'by'], ['A', '1950'], ['B', '1951']]
+    chunks = list(rd.read_chunks(object(), ['by'], fallback=lambda x: (iter(rows), None)))
+    assert list(chunks[0].by) == ['1950', '1951']
+
+def test_frame_with_missing_numbers(tmpdir):
+    # A numeric column with a gap is float, but reads as the csv does
+    frame = pd.DataFrame({'by': [1950, None, 1951.5]})
+    assert list(next(rd.read_chunks(frame, ['by'])).by) == ['1950', '', '1951.5']
+    frame = pd.DataFrame({'by': [1950, None]})
+    filename = str(tmpdir.join('by.csv'))
+    pd.DataFrame({'by': [1950, 1951]}).to_csv(filename, index=False)
+    store = rc.RecordStore(['by'])
+    for source in [frame, filename]:
+        for chunk in rd.read_chunks(source, ['by']):
+            store.append_columns([chunk.by], 1, list(chunk.index))
+    store.finish()
+    assert store.values['by'] == ['1950', '', '1951']
+    assert list(store.codes['by']) == [0, 1, 0, 2]
+
+def test_append_columns():
+    rows = [['1950', 'MEIER'], ['1951', 'MAIER'], ['1950', 'MAIER']]
+    by_row = rc.RecordStore(['by', 'lname'])
+    for i, row in enumerate(rows):
+        by_row.append(row, 1, i)
+    by_row.finish()
+    by_chunk = rc.RecordStore(['by', 'lname'])
+    by_chunk.append_columns([[x[0] for x in rows[:2]], [x[1] for x in rows[:2]]], 1, [0, 1])
+    by_chunk.append(rows[2], 1, 2)
+    by_chunk.finish()
+    for f in ['by', 'lname']:
+        assert list(by_row.codes[f]) == list(by_chunk.codes[f])
+    assert by_chunk.uids == [0, 1, 2]
+    blocking = Blocking(exact=['by'], phonetic=['lname'], prefix={'lname': 2})
+    keys = blocking.keys({'by': [x[0] for x in rows], 'lname': [x[1] for x in rows]})
+    assert keys == [blocking.key({'by': x[0], 'lname': x[1]}) for x in rows]
@@ -0,0 +1,54 @@
+# Test code for the columnar record store
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import records as rc
+
+def make_store():
+    store = rc.RecordStore(['by', 'lname'])
+    store.append(['1950', 'MEIER'], 1, 'a')
+    store.append(['1951', 'MAIER'], 1, 'b')
+    store.append(['1950', 'MAIER'], 2, 'c')
+    store.finish()
+    return store
+
+def test_matrix():
+    store = make_store()
+    assert list(store.codes['lname']) == [0, 1, 1]
+    assert list(store.filenum) == [1, 1, 2]
+    X, ps, values = store.matrix({'by': 'c', 'lname': 's'})
+    assert ps == 1
+    assert values == [['MEIER', 'MAIER']]
+    assert X.tolist() == [[0, 0], [1, 1], [1, 0]]
+    # Codes are renumbered within a subset of records
+    X, ps, values = store.matrix({'by': 'c', 'lname': 's'}, rows=np.array([1, 2]))
+    assert values == [['MAIER']]
+    assert X.tolist() == [[0, 1], [0, 0]]
+
+def test_filled():
+    store = make_store()
+    store.append(['', 'MEIER'], 2, 'd')
+    store.append(['', ''], 2, 'e')
+    store.finish()
+    assert list(store.filled()) == [2, 2, 2, 1, 0]
+
+def test_save(tmpdir):
+    filename = str(tmpdir.join('records.npz'))
+    make_store().save(filename)
+    store = rc.RecordStore.load(filename)
+    assert store.uids == ['a', 'b', 'c']
+    frame = store.to_frame()
+    assert list(frame.columns) == ['by', 'lname', 'ETL_ID']
+    assert list(frame.lname) == ['MEIER', 'MAIER', 'MAIER']
+    store.append(['1952', 'MEIER'], 2, 'd')
+    store.finish()
+    assert list(store.codes['lname']) == [0, 1, 1, 0]
+
+def test_collapse():
+    X = np.array([[0, 1], [0, 1], [2, 0], [0, 1]])
+    rows, filenum, counts, inverse = rc.collapse(X, [1, 1, 1, 2])
+    assert rows.tolist() == [[0, 1], [2, 0], [0, 1]]
+    assert list(filenum) == [1, 1, 2]
+    assert list(counts) == [2, 1, 1]
+    assert (rows[inverse] == X).all()
@@ -0,0 +1,82 @@
+# Test code for saving and reopening runs
+
+import sys
+sys.path.append('../python-encapsulation')
+import numpy as np
+import eblink as eb
+import run_store as rs
+from blocking import Blocking
+from crosswalk import find_clusters, crosswalk_frame
+from records import RecordStore
+from test_eblink import make_numpy_link
+
+def make_run(tmpdir):
+    link = eb.EBlink(files=['a.csv', 'b.csv'])
+    link._columns = [['by', 'lname']] * 2
+    link._matchcolumns = {'by': ['by'], 'lname': ['lname']}
+    link._indices = ['UID', 'UID']
+    link._column_types = {'by': 'c', 'lname': 's'}
+    link.alpha, link.beta, link.iterations = 1, 99, 10
+    link._blocking = Blocking(exact=['by'])
+    link._records = RecordStore(['by', 'lname'])
+    for row, f, uid in [(['1950', 'MEIER'], 1, 'a'), (['1951', 'MAIER'], 1, 'b'),
+     (['1950', 'MAIER'], 2, 'c'), (['1951', 'MAIER'], 2, 'd')]:
+        link._records.append(row, f, uid)
+    link._records.finish()
+    link._filenum, link._uids = link._records.filenum, link._records.uids
+    link._numrecords = link._num_linked = 4
+    link._blocks = np.array([0, 1, 0, 1])
+    link._block_ids = {('1950',): 0, ('1951',): 1}
+    link._results = {0: (2, []), 1: (1, [(2, 4)])}
+    link._collect_results()
+    link._clusters = find_clusters(4, link.pairs)
+    link.crosswalk = crosswalk_frame(link._clusters, link._filenum, link._uids)
+    lam = str(tmpdir.join('lambda.npy'))
+    np.save(lam, np.zeros((5, 2), dtype=np.int32))
+    link._lambda_files = {1: [(lam, 3), np.ones((2, 2), dtype=np.int32)]}
+    link._states = {1: {'Y': np.array([[1, 0]])}}
+    return link
+
+def test_save_and_open(tmpdir):
+    link = make_run(tmpdir)
+    path = str(tmpdir.join('run'))
+    link.save_run(path)
+
+    run = rs.RunStore(path)
+    assert run.config['version'] == rs.FORMAT_VERSION
+    assert isinstance(run.pairs, np.memmap)
+    assert run.pairs.tolist() == [[2, 4]]
+    # Only the draws made are kept from a stopped run
+    assert run.lambda_history(1).shape == (5, 2)
+    assert run.state(1)['Y'].tolist() == [[1, 0]]
+    assert run.state(0) is None
+
+    opened = eb.EBlink.open_run(path)
+    assert isinstance(opened._records.codes['lname'], np.memmap)
+    assert list(opened._records.values['lname']) == ['MEIER', 'MAIER']
+    assert list(opened._uids) == ['a', 'b', 'c', 'd']
+    assert opened._results == {0: (2, []), 1: (1, [(2, 4)])}
+    assert opened._block_ids == link._block_ids
+    assert opened._blocking.exact == ['by']
+    assert opened.pop_est == 3
+    assert list(opened.crosswalk.cluster) == list(link.crosswalk.cluster)
+    opened.build_linked_data()
+    assert len(opened.linked_set) == 3
+
+def test_incremental_after_open(tmpdir):
+    link = make_numpy_link(2)
+    link.model(backend='numpy', seeds=1)
+    path = str(tmpdir.join('run'))
+    link.save_run(path)
+    link.clean_tmp()
+
+    opened = eb.EBlink.open_run(path)
+    assert isinstance(opened._states, rs.LazyStates)
+    assert opened._states._loaded == {}
+    assert opened._columns == link._columns and isinstance(opened._columns[0][0], str)
+    columns = dict((col, [col]) for col in opened._columns[0])
+    opened.add_files(['../test_data/RLData500_3.csv'], columns, ['UID'])
+    opened.model_incremental(iterations=10)
+    opened.clean_tmp()
+    opened.build_crosswalk()
+    assert len(opened.crosswalk) == opened._numrecords > link._numrecords
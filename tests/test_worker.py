@@ -0,0 +1,37 @@
+# Test code for long-lived workers
+
+import sys
+sys.path.append('../python-encapsulation')
+import time
+import numpy as np
+import pandas as pd
+import parallel as pl
+import worker as wk
+from rng import Streams
+
+def test_run_remote(tmpdir):
+    tmp = str(tmpdir.join('records.csv'))
+    data = pd.read_csv('../test_data/RLData500_1.csv').head(40)
+    data[['fname_c1', 'lname_c1', 'by']].to_csv(tmp, index=False)
+    types = {'fname_c1': 's', 'lname_c1': 's', 'by': 'c'}
+    units = [('numpy', (tmp, str(tmpdir), types, 1, 99, 5, [1] * 20 + [2] * 20, 40),
+     {'streams': Streams(1, chain)}) for chain in range(3)]
+    addresses = [str(tmpdir.join('worker-{}'.format(i))) for i in range(2)]
+    workers = [wk.start(address, 'secret') for address in addresses]
+    try:
+        for _ in range(50):
+            if all(tmpdir.join('worker-{}'.format(i)).check() for i in range(2)):
+                break
+            time.sleep(.1)
+        remote = pl.run_units(units, addresses=addresses, authkey='secret')
+        local = pl.run_units(units)
+        for (lam, est, run), (local_lam, local_est, local_run) in zip(remote, local):
+            assert (lam == local_lam).all()
+            assert (est == local_est).all()
+            assert run == local_run
+    finally:
+        for address in addresses:
+            wk.stop(address, 'secret')
+        for process in workers:
+            process.join(5)
+    assert not any(process.is_alive() for process in workers)